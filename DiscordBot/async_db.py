@@ -0,0 +1,219 @@
+# async_db.py
+import asyncio
+import queue
+import sqlite3 as sl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BUSY_TIMEOUT_MS = 5000
+
+
+class DeferredCommit:
+    '''
+    Connection handed to write jobs. The writer thread commits each batch once, so the commit()
+    calls inside the database module's functions are no-ops here.
+    '''
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def commit(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class AsyncDatabase:
+    '''
+    Async front end for reports.db. Writes are queued to a single writer thread that runs them in
+    group-committed batches on a WAL-mode connection; reads run on a small pool of threads, each with
+    its own connection. Both take a function called as fn(connection, *args), which is the signature
+    of the functions in database.py, and return an awaitable for its result. If observer is given,
+    it is called as observer(seconds, "read" or "write", fn name) when each call completes.
+
+    If the writer thread stops, whether because setup failed, the connection broke or close() was
+    called, every queued write fails and later writes raise sl.OperationalError instead of waiting.
+    '''
+
+    def __init__(self, path, readers=2, max_batch=64, batch_window=0.002, observer=None):
+        self.path = path
+        self.readers = readers
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.observer = observer
+        self.jobs = queue.Queue()
+        self.local = threading.local()
+        self.read_connections = []
+        self.read_connections_lock = threading.Lock()
+        self.loop = None
+        self.writer = None
+        self.writer_error = None  # set once the writer thread has stopped
+        self.read_pool = None
+        self.batches = 0
+        self.writes = 0
+
+    async def start(self, setup=None):
+        '''
+        Starts the writer thread and read pool. setup, if given, is called with the writer's
+        connection before any other job (e.g. migrations.migrate).
+        '''
+        if self.writer is not None:
+            return
+        self.loop = asyncio.get_event_loop()
+        self.writer_error = None
+        ready = self.loop.create_future()
+        self.writer = threading.Thread(target=self.write_loop, args=(setup, ready), name="db-writer", daemon=True)
+        self.writer.start()
+        self.read_pool = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+        await ready
+
+    async def close(self):
+        if self.writer is not None:
+            self.jobs.put(None)
+            await self.loop.run_in_executor(None, self.writer.join)
+            self.writer = None
+        if self.read_pool is not None:
+            await self.loop.run_in_executor(None, self.read_pool.shutdown)
+            self.read_pool = None
+        with self.read_connections_lock:
+            for connection in self.read_connections:
+                connection.close()
+            self.read_connections = []
+
+    async def write(self, fn, *args):
+        if self.writer_error is not None:
+            raise self.writer_error
+        if self.writer is None:
+            raise RuntimeError("AsyncDatabase.write called before start()")
+        start = time.perf_counter()
+        future = self.loop.create_future()
+        self.jobs.put((fn, args, future))
+        try:
+            return await future
+        finally:
+            self.observe(start, "write", fn)
+
+    async def read(self, fn, *args):
+        if self.read_pool is None:
+            raise RuntimeError("AsyncDatabase.read called before start() or after close()")
+        start = time.perf_counter()
+        try:
+            return await self.loop.run_in_executor(self.read_pool, self.run_read, fn, args)
+        finally:
+            self.observe(start, "read", fn)
+
+    def observe(self, start, kind, fn):
+        if self.observer is not None:
+            self.observer(time.perf_counter() - start, kind, getattr(fn, "__name__", "unknown"))
+
+    def run_read(self, fn, args):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sl.connect(self.path, check_same_thread=False)
+            connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self.local.connection = connection
+            with self.read_connections_lock:
+                self.read_connections.append(connection)
+        return fn(connection, *args)
+
+    def resolve(self, future, ok, value):
+        if future.cancelled():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def writer_stopped(self, error):
+        # Runs on the event loop, like write(), so no job can be queued after the queue is drained
+        self.writer_error = sl.OperationalError(f"database writer stopped: {error!r}" if error else "database is closed")
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                self.resolve(job[2], False, self.writer_error)
+
+    def write_loop(self, setup, ready):
+        try:
+            # isolation_level=None leaves transactions to us, so a batch is exactly one BEGIN/COMMIT
+            connection = sl.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # other bot processes (shards) may hold the write lock for a moment
+            connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            if setup is not None:
+                setup(connection)
+        except Exception as e:
+            self.loop.call_soon_threadsafe(self.resolve, ready, False, e)
+            self.loop.call_soon_threadsafe(self.writer_stopped, e)
+            return
+        self.loop.call_soon_threadsafe(self.resolve, ready, True, None)
+
+        error = None
+        try:
+            self.run_batches(connection)
+        except Exception as e:
+            error = e
+        finally:
+            connection.close()
+            self.loop.call_soon_threadsafe(self.writer_stopped, error)
+
+    def run_batches(self, connection):
+        deferred = DeferredCommit(connection)
+        stopping = False
+        while not stopping:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            # Collect whatever else arrives within the batch window so it shares one commit
+            batch = [job]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    job = self.jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+
+            # Every future in the batch is resolved, even if the connection breaks and the writer stops
+            results = [(future, False, sl.OperationalError("write batch did not complete")) for _, _, future in batch]
+            try:
+                results = self.run_batch(connection, deferred, batch)
+            except sl.Error as e:
+                # e.g. BEGIN timing out on a lock another shard process holds past busy_timeout
+                results = [(future, False, e) for _, _, future in batch]
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+            finally:
+                self.batches += 1
+                self.writes += len(batch)
+                for future, ok, value in results:
+                    self.loop.call_soon_threadsafe(self.resolve, future, ok, value)
+
+    def run_batch(self, connection, deferred, batch):
+        results = []
+        connection.execute("BEGIN")
+        for fn, args, future in batch:
+            # A savepoint per job, so one failing write doesn't undo the rest of the batch
+            connection.execute("SAVEPOINT job")
+            try:
+                results.append((future, True, fn(deferred, *args)))
+                connection.execute("RELEASE job")
+            except Exception as e:
+                connection.execute("ROLLBACK TO job")
+                connection.execute("RELEASE job")
+                results.append((future, False, e))
+        try:
+            connection.execute("COMMIT")
+        except sl.Error as e:
+            connection.execute("ROLLBACK")
+            results = [(future, False, e) for future, _, _ in results]
+        return results
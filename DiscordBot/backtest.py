@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# backtest.py
+'''
+Evaluates should_flag rule sets (see rules.py) against the scores stored in reports.db and the
+moderator resolutions of the reports on those messages, in one vectorized pass over every rule set.
+
+A message counts as positive if a moderator acted on a report about it (ban, restriction, alerting
+authorities) and negative if its reports were all resolved without action. Messages never reported
+or still open are unlabeled: they only count towards flag volume, unless --unreported-negative
+treats them as negatives. Messages the current rules never flagged are mostly unlabeled, so recall
+here is recall among reported messages.
+
+    python3 backtest.py --sweep large.large_identity_attack=0.5:0.8:0.05
+    python3 backtest.py --rules candidates.json --days 30 --json
+'''
+import argparse
+import json
+import sqlite3 as sl
+import sys
+import numpy as np
+import database as database
+import rules
+
+
+def load(db_path, since):
+    db = sl.connect(db_path)
+    try:
+        rows = database.get_scored_outcomes(db, since)
+    finally:
+        db.close()
+    table = np.array([[np.nan if value is None else value for value in row] for row in rows], np.float64) \
+        if rows else np.zeros((0, 3 + len(database.SCORE_ATTRIBUTES)))
+    word_counts, created_at = table[:, 0], table[:, 1]
+    # a score a backend didn't produce counts as 0, like in ModBot.should_flag
+    scores = {attr: np.nan_to_num(table[:, 2 + i]) for i, attr in enumerate(database.SCORE_ATTRIBUTES)}
+    outcomes = table[:, -1]
+    return word_counts, created_at, scores, outcomes
+
+
+def sweep(spec):
+    '''
+    "large.threat=0.7:0.95:0.05" -> rule sets that vary large.threat from 0.7 to 0.95 around the
+    default; without a section ("threat=...") both sections move together.
+    '''
+    key, _, values = spec.partition("=")
+    start, stop, step = (float(v) for v in values.split(":"))
+    section, _, name = key.rpartition(".")
+    sections = [section] if section else ["small", "large"]
+    if key == "max_small_words":
+        sections = []
+    rule_sets = []
+    for value in np.arange(start, stop + step / 2, step):
+        value = round(float(value), 6)
+        candidate = {"name": f"{key}={value}", "small": {}, "large": {}}
+        if sections:
+            for section in sections:
+                candidate[section][name] = value
+        else:
+            candidate["max_small_words"] = int(value)
+            candidate["name"] = f"{key}={int(value)}"
+        rule_sets.append(rules.complete(candidate))
+    return rule_sets
+
+
+def evaluate(rule_sets, word_counts, created_at, scores, outcomes, unreported_negative=False):
+    flagged = rules.flag_masks(scores, word_counts, rule_sets)  # (R, N)
+    positive = outcomes == 1
+    negative = (outcomes == 0) | (np.isnan(outcomes) if unreported_negative else False)
+
+    true_positives = (flagged & positive).sum(axis=1)
+    false_positives = (flagged & negative).sum(axis=1)
+    false_negatives = (~flagged & positive).sum(axis=1)
+    days = max((created_at.max() - created_at.min()) / 86400, 1.0) if len(created_at) else 1.0
+
+    results = []
+    for i, rule_set in enumerate(rule_sets):
+        tp, fp, fn = int(true_positives[i]), int(false_positives[i]), int(false_negatives[i])
+        results.append({
+            "name": rule_set["name"],
+            "flagged": int(flagged[i].sum()),
+            "flag_rate": round(float(flagged[i].mean()), 4) if len(word_counts) else 0.0,
+            "flagged_per_day": round(float(flagged[i].sum()) / days, 1),
+            "true_positives": tp,
+            "false_positives": fp,
+            "false_negatives": fn,
+            "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+            "recall": round(tp / (tp + fn), 4) if tp + fn else None,
+        })
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="reports.db")
+    parser.add_argument("--rules", help="JSON file with a rule set or a list of them (partial sets fill in from the default)")
+    parser.add_argument("--sweep", action="append", default=[], help="section.key=start:stop:step, may be repeated")
+    parser.add_argument("--days", type=float, default=None, help="only messages scored in the last N days")
+    parser.add_argument("--unreported-negative", action="store_true", help="count unreported messages as negatives")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    rule_sets = [rules.DEFAULT_RULES]
+    if args.rules:
+        with open(args.rules, encoding="utf-8") as f:
+            loaded = json.load(f)
+        rule_sets += [rules.complete(rule_set) for rule_set in (loaded if isinstance(loaded, list) else [loaded])]
+    for spec in args.sweep:
+        rule_sets += sweep(spec)
+
+    since = database.now() - int(args.days * 86400) if args.days is not None else 0
+    word_counts, created_at, scores, outcomes = load(args.db, since)
+    if not len(word_counts):
+        sys.exit("No stored scores to backtest against.")
+    results = evaluate(rule_sets, word_counts, created_at, scores, outcomes, args.unreported_negative)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        labeled = int((~np.isnan(outcomes)).sum())
+        print(f"{len(word_counts)} scored messages, {labeled} with resolved reports "
+              f"({int((outcomes == 1).sum())} acted on)")
+        print(f"{'rule set':<40} {'flagged':>8} {'per day':>8} {'precision':>9} {'recall':>7}")
+        for result in results:
+            precision = "-" if result["precision"] is None else f"{result['precision']:.3f}"
+            recall = "-" if result["recall"] is None else f"{result['recall']:.3f}"
+            print(f"{result['name']:<40} {result['flagged']:>8} {result['flagged_per_day']:>8} {precision:>9} {recall:>7}")
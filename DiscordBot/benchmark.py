@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+# benchmark.py
+'''
+Offline load benchmark for ModBot. Drives on_message (channel traffic), handle_dm (the full
+Report.handle_message flow) and on_raw_reaction_add (the moderator workflow) with synthetic events
+against fakes.FakeModBot and a local Perspective stand-in, then reports throughput, handler
+latency and event-loop lag for each phase. A channel message's latency runs from on_message until
+it has been scored and flag_channel_message has run. Latency and throughput only count events that
+were handled successfully; the run exits non-zero if any failed, scoring failures included (or,
+with --max-p99-ms, if any phase ran too slow).
+
+    python3 benchmark.py --messages 2000 --reports 50 --perspective-latency 0.05 --json
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import workflow
+from fakes import FakeDiscord, FakeModBot, FakePayload, PerspectiveStandIn
+from pipeline import TokenBucket
+
+BENIGN = [
+    "hey everyone, is the lecture recorded today?",
+    "lol that's a good one",
+    "anyone want to grab lunch after section",
+    "I pushed the fix to the repo, can someone review",
+    "thanks!",
+]
+SUSPICIOUS = [
+    "you are so stupid it hurts",
+    "nobody likes you, just go die",
+    "I hate this stupid class and everyone in it",
+    "how old are you? where do you live?",
+    "free nitro giveaway, dm me your login",
+]
+ESCALATE = [
+    "I am going to kill you after class",
+    "kys nobody wants you here",
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoopLagMonitor:
+    # measures how late a 10ms sleep wakes up, i.e. how long the loop was blocked
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self.samples = []
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        return self.samples
+
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.events = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.lag = []
+
+    async def timed(self, coro):
+        # failed events are counted as errors only, so they can't flatter latency or throughput
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.errors += 1
+            print(f"[{self.name}] handler failed: {e!r}", file=sys.stderr)
+            return
+        self.latencies.append(time.perf_counter() - start)
+        self.events += 1
+
+    def result(self):
+        return {
+            "phase": self.name,
+            "events": self.events,
+            "errors": self.errors,
+            "seconds": round(self.elapsed, 3),
+            "events_per_sec": round(self.events / self.elapsed, 1) if self.elapsed > 0 else 0.0,
+            "p50_ms": round(percentile(self.latencies, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 2),
+            "loop_lag_p99_ms": round(percentile(self.lag, 0.99) * 1000, 2),
+            "loop_lag_max_ms": round(max(self.lag, default=0.0) * 1000, 2),
+        }
+
+
+async def run_phase(phase, bot, body):
+    monitor = LoopLagMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    await body()
+    # the phase isn't over until queued scoring and echoed mod messages have been handled
+    await bot.pipeline.queue.join()
+    await bot.fake.drain()
+    phase.elapsed = time.perf_counter() - start
+    phase.lag = await monitor.stop()
+    return phase.result()
+
+
+class ScoringTracker:
+    '''
+    Hooks the bot's scoring pipeline so a channel message counts as handled once it has been scored
+    and flag_channel_message has run, not when on_message returns after queueing it.
+    '''
+
+    def __init__(self, bot):
+        self.pending = {}  # message id -> future, True once handled, False if scoring failed
+        self.submit, self.on_scored = bot.pipeline.submit, bot.pipeline.on_scored
+        bot.pipeline.submit, bot.pipeline.on_scored = self.tracked_submit, self.tracked_on_scored
+        bot.pipeline.on_failed = self.on_failed
+
+    async def tracked_submit(self, message):
+        self.pending[message.id] = asyncio.get_event_loop().create_future()
+        await self.submit(message)
+
+    async def tracked_on_scored(self, message, scored):
+        await self.on_scored(message, scored)
+        self.settle(message, True)
+
+    def on_failed(self, message, error):
+        self.settle(message, False)
+
+    def settle(self, message, ok):
+        future = self.pending.get(message.id)
+        if future is not None and not future.done():
+            future.set_result(ok)
+
+    async def handle(self, bot, message):
+        await bot.on_message(message)
+        future = self.pending.get(message.id)
+        if future is not None:
+            ok = await future
+            del self.pending[message.id]
+            if not ok:
+                raise RuntimeError(f"scoring message {message.id} failed")
+
+
+async def channel_phase(bot, args, rng):
+    phase = Phase("channel_messages")
+    author = bot.member("chatty")
+    corpus = BENIGN * 16 + SUSPICIOUS * 3 + ESCALATE
+    tracker = ScoringTracker(bot)
+
+    async def body():
+        interval = 1.0 / args.rate if args.rate > 0 else 0.0
+        tasks = []
+        for _ in range(args.messages):
+            message = bot.fake_main.post(author, rng.choice(corpus))
+            tasks.append(asyncio.ensure_future(phase.timed(tracker.handle(bot, message))))
+            if interval:
+                await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+
+    return await run_phase(phase, bot, body)
+
+
+async def report_phase(bot, args, rng):
+    phase = Phase("dm_reports")
+    target = bot.member("offender")
+
+    async def one_report(i):
+        reporter = bot.member(f"reporter-{i}")
+        reported = bot.fake_main.post(target, rng.choice(SUSPICIOUS))
+        # Harassment -> Bullying, don't block, no additional info
+        for content in ["report", bot.message_link(reported), "2", "3", "no", "no"]:
+            await phase.timed(bot.on_message(reporter.dm_channel.post(reporter, content)))
+
+    return await run_phase(phase, bot, lambda: asyncio.gather(*(one_report(i) for i in range(args.reports))))
+
+
+async def reaction_phase(bot, args, rng):
+    phase = Phase("moderator_reactions")
+    moderator = bot.member("moderator")
+
+    async def resolve(mod_msg_id):
+        while mod_msg_id in bot.open_threads:
+            step = bot.report_steps[mod_msg_id]
+            emoji = rng.choice(sorted(workflow.STEP_EMOJIS[step]))
+            payload = FakePayload(bot.fake_mod.id, mod_msg_id, moderator.id, emoji)
+            await phase.timed(bot.on_raw_reaction_add(payload))
+
+    return await run_phase(phase, bot, lambda: asyncio.gather(*(resolve(i) for i in list(bot.open_threads))))
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    fake = FakeDiscord(latency=args.discord_latency, jitter=args.discord_latency / 2, seed=args.seed)
+    perspective = PerspectiveStandIn(latency=args.perspective_latency, jitter=args.perspective_latency / 2,
+                                     error_rate=args.error_rate, seed=args.seed)
+    url = await perspective.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = FakeModBot(fake, url, os.path.join(tmp, "reports.db"))
+        bot.perspective.rate_limiter = TokenBucket(args.qps) if args.qps > 0 else None
+        bot.pipeline.workers = args.workers
+        await bot.setup()
+
+        results = [
+            await channel_phase(bot, args, rng),
+            await report_phase(bot, args, rng),
+            await reaction_phase(bot, args, rng),
+        ]
+        extra = {
+            "perspective_requests": perspective.requests,
+            "perspective_errors": perspective.errors,
+            "discord_calls": fake.calls,
+            "score_cache": bot.score_cache.stats(),
+            "prefilter": bot.prefilter.stats(),
+        }
+        await bot.close()
+    await perspective.stop()
+    return results, extra
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000, help="channel messages to send")
+    parser.add_argument("--rate", type=float, default=0, help="channel messages per second (0 = as fast as possible)")
+    parser.add_argument("--reports", type=int, default=25, help="DM reports to file")
+    parser.add_argument("--workers", type=int, default=4, help="scoring pipeline workers")
+    parser.add_argument("--qps", type=float, default=0, help="Perspective QPS limit (0 = unlimited)")
+    parser.add_argument("--discord-latency", type=float, default=0.02, help="seconds per fake Discord REST call")
+    parser.add_argument("--perspective-latency", type=float, default=0.05, help="seconds per Perspective call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Perspective calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--max-p99-ms", type=float, default=None,
+                        help="exit non-zero if any phase's p99 handler latency exceeds this")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results, extra = asyncio.run(main(args))
+
+    if args.json:
+        print(json.dumps({"phases": results, **extra}, indent=2))
+    else:
+        for result in results:
+            print(f"{result['phase']:>20}: {result['events']} events in {result['seconds']}s "
+                  f"({result['events_per_sec']}/s), p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                  f"loop lag p99 {result['loop_lag_p99_ms']} ms (max {result['loop_lag_max_ms']} ms), "
+                  f"{result['errors']} errors")
+        for key, value in extra.items():
+            print(f"{key:>20}: {value}")
+
+    if any(r["errors"] > 0 for r in results):
+        sys.exit(1)
+    if args.max_p99_ms is not None and any(r["p99_ms"] > args.max_p99_ms for r in results):
+        sys.exit(1)
@@ -1,50 +1,218 @@
 # bot.py
 from operator import mod
+import asyncio
+import time
+import aiohttp
 import discord
 from discord.ext import commands
 import os
 import json
-import logging
 import re
-import requests
 from report import Report
 from report import State
 import sqlite3 as sl  # use DB to hold reports
 import database as database
-
-# Set up logging to the console
-logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
-
-discord_token = os.environ["discord"]
-perspective_key = os.environ["perspective"]
-
-class ModBot(discord.Client):
-    def __init__(self, key):
+import threads
+import workflow
+import migrations
+from async_db import AsyncDatabase
+from perspective import PerspectiveClient, ATTRIBUTES
+from local_model import LocalScorer
+from cache import ScoreCache, MessageScoreStore, content_hash
+from pipeline import ScoringPipeline, TokenBucket
+from prefilter import PreFilter, Verdict
+import rules
+from sessions import SessionStore
+from recorder import EventRecorder
+import metrics
+import log_config
+
+log_file = os.environ.get("log_file", "discord.log")
+log_max_bytes = int(os.environ.get("log_max_bytes", 10 * 1024 * 1024))  # rotate the log file past this size
+log_backups = int(os.environ.get("log_backups", 5))
+log_levels = log_config.parse_mapping(os.environ.get("log_levels", "discord=DEBUG"), str.upper)
+log_sample = log_config.parse_mapping(os.environ.get("log_sample"), int)  # e.g. "discord.gateway=100": keep 1 in 100 DEBUG lines
+perspective_timeout = float(os.environ.get("perspective_timeout", 10))
+perspective_concurrency = int(os.environ.get("perspective_concurrency", 16))
+perspective_qps = float(os.environ.get("perspective_qps", 1))
+scoring_workers = int(os.environ.get("scoring_workers", 4))
+reaction_concurrency = int(os.environ.get("reaction_concurrency", 4))
+history_max_reports = int(os.environ.get("history_max_reports", 25))
+replay_mod_history = os.environ.get("replay_mod_history") == "1"  # also adopt reports missing from reports.db
+replay_limit = int(os.environ["replay_limit"]) if "replay_limit" in os.environ else None  # max messages per replay
+score_cache_size = int(os.environ.get("score_cache_size", 10000))
+score_cache_ttl = float(os.environ.get("score_cache_ttl", 6 * 60 * 60))
+score_cache_db = os.environ.get("score_cache_db")  # e.g. "score_cache.db" to keep scores across restarts
+message_scores_size = int(os.environ.get("message_scores_size", 10000))  # recent per-message scores kept in memory
+scorer_backend = os.environ.get("scorer", "perspective")  # "perspective" or "local"
+scorer_fallback = os.environ.get("scorer_fallback")  # "local" to score locally while Perspective is failing
+local_model = os.environ.get("local_model")  # trained local_model.py model; defaults to the built-in lexicon
+flag_rules = os.environ.get("flag_rules")  # JSON rule set for should_flag (see rules.py and backtest.py)
+prefilter_threshold = float(os.environ.get("prefilter_threshold", -1.0))  # negative disables skipping
+prefilter_escalate = os.environ.get("prefilter_escalate") == "1"  # post escalation phrases to moderators unscored
+report_idle_ttl = float(os.environ.get("report_idle_ttl", 30 * 60))  # seconds before an idle DM report is dropped
+record_events = os.environ.get("record_events")  # e.g. "events.jsonl" to capture inbound events for replay.py
+record_redact = os.environ.get("record_redact") == "1"  # hash ids, names and message text in the recording
+metrics_port = int(os.environ["metrics_port"]) if "metrics_port" in os.environ else None  # serves /metrics if set
+metrics_host = os.environ.get("metrics_host", "127.0.0.1")
+
+REPLAY_CHECKPOINT = "mod_channel_replay"
+REPLAY_PAGE_SIZE = 100  # messages per history request
+HISTORY_WINDOWS = [("24h", 24 * 60 * 60), ("7d", 7 * 24 * 60 * 60)]
+STALE_REPORT_AGE = 24 * 60 * 60  # open reports older than this are called out at startup
+
+# Sharding: by default one process runs as many shards as Discord recommends. To spread guilds over
+# several processes sharing reports.db, give every process the same shard_count and its own shard_ids.
+shard_count = int(os.environ["shard_count"]) if "shard_count" in os.environ else None
+shard_ids = [int(i) for i in os.environ["shard_ids"].split(",")] if "shard_ids" in os.environ else None
+
+class ModBot(discord.AutoShardedClient):
+    def __init__(self, key, db_path="reports.db"):
         intents = discord.Intents.default()
-        super().__init__(command_prefix='.', intents=intents)
+        super().__init__(command_prefix='.', intents=intents, shard_count=shard_count, shard_ids=shard_ids)
         self.group_num = None
-        self.mod_channels = {}  # Map from guild to the mod channel id for that guild
-        self.reports = {}  # Map from user IDs to the state of their report
+        self.mod_channels = {}  # Map from guild id to the mod channel for that guild
+        self.main_channels = {}  # Map from guild id to the id of the channel the bot moderates in that guild
+        self.reports = SessionStore(report_idle_ttl)  # Map from user IDs to the state of their report
+        self.session_sweeper = None
+        self.metrics = metrics.Registry()
+        self.handler_latency = self.metrics.histogram(
+            "modbot_handler_seconds", "Time spent in bot handlers.", ["handler"])
+        self.db_latency = self.metrics.histogram(
+            "modbot_db_seconds", "Time from submitting a database call to its result, queueing included.", ["op", "call"])
+        self.channel_messages = self.metrics.counter(
+            "modbot_channel_messages", "Channel messages by outcome: skipped by the pre-filter, escalated by it, "
+            "or flagged/unflagged after scoring.", ["outcome"])
+        self.loop_lag = self.metrics.histogram(
+            "modbot_event_loop_lag_seconds", "How late a periodic event loop wake-up ran.")
+        self.metrics.gauge("modbot_report_sessions", "DM reports in progress.", fn=lambda: len(self.reports))
+        self.metrics.gauge("modbot_open_threads", "Open reports awaiting moderator action.", fn=lambda: len(self.open_threads))
+        self.metrics.gauge("modbot_scoring_queue", "Messages waiting to be scored.", fn=lambda: self.pipeline.ensure_queue().qsize())
+        self.current_loop_lag = self.metrics.gauge("modbot_event_loop_lag_last_seconds", "The latest event loop lag sample.")
+        self.metrics_tasks = []
+        self.metrics_runner = None
         self.perspective_key = key
+        self.perspective = PerspectiveClient(
+            key, total_timeout=perspective_timeout, max_concurrency=perspective_concurrency,
+            rate_limiter=TokenBucket(perspective_qps)
+        )
+        self.scorer = LocalScorer(local_model) if scorer_backend == "local" else self.perspective
+        self.fallback_scorer = LocalScorer(local_model) if scorer_fallback == "local" and self.scorer is self.perspective else None
+        self.scorer_fallbacks = self.metrics.counter(
+            "modbot_scorer_fallbacks", "Messages scored by the fallback scorer because the primary failed.")
+        self.flag_rules = rules.load_rules(flag_rules) if flag_rules else rules.DEFAULT_RULES
+        self.prefilter = PreFilter(prefilter_threshold, prefilter_escalate)
+        self.score_cache = ScoreCache(score_cache_size, score_cache_ttl, score_cache_db, self.scorer.name)
+        self.message_scores = MessageScoreStore(self.load_message_scores, message_scores_size)
+        self.pipeline = ScoringPipeline(
+            self.eval_text, self.flag_channel_message,
+            workers=scoring_workers, score_batch=self.eval_batch if self.scorer.batched else None
+        )
         self.open_threads = dict()
-        self.header = {"Authorization": f"Bot {discord_token}", "Content-Type": "application/json"}
-        self.db = None
+        self.db = AsyncDatabase(db_path, observer=self.db_latency.observe)
         self.open_entries = {}
-        self.main_channel = None
+        self.offered_reactions = {}  # Map from open report message id to the reactions the bot has put on it
+        self.report_steps = {}  # Map from open report message id to its workflow.Step
+        self.reaction_limit = asyncio.Semaphore(reaction_concurrency)
+        self.recorder = EventRecorder(record_events, record_redact) if record_events else None
 
     async def loadOpenReports(self):
-        mod_channel = await self.fetch_channel(list(self.mod_channels.values())[0].id)
-        messages = await mod_channel.history().flatten()
-        for message in messages:
-            if message.author == self.user: 
+        # Restore the unresolved reports of this process's guilds from the registry in reports.db; no Discord calls needed
+        guild_ids = set(self.mod_channels)
+        for mod_msg_id, thread_id, step, history_shown, db_entry in await self.db.read(database.get_open_reports, guild_ids):
+            self.restore_report(mod_msg_id, thread_id, workflow.Step[step], history_shown, db_entry)
+
+        stale = await self.db.read(database.get_open_reports_before, database.now() - STALE_REPORT_AGE)
+        if stale:
+            print(f"{len(stale)} open reports are older than {STALE_REPORT_AGE // 3600}h, "
+                  f"the oldest from {database.format_time(stale[0][1])}")
+
+        if replay_mod_history:
+            for mod_channel in list(self.mod_channels.values()):
+                await self.replayModChannel(mod_channel)
+
+    def restore_report(self, mod_msg_id, thread_id, step, history_shown, db_entry):
+        self.open_entries[mod_msg_id] = db_entry
+        self.open_threads[mod_msg_id] = str(thread_id)
+        self.report_steps[mod_msg_id] = step
+        self.offered_reactions[mod_msg_id] = set(workflow.STEP_EMOJIS[step])
+        if not history_shown:
+            self.offered_reactions[mod_msg_id].add(workflow.HISTORY_EMOJI)
+
+    async def replayModChannel(self, mod_channel):
+        '''
+        Adopts reports the registry doesn't know about by re-reading the bot's messages in a guild's mod channel.
+        Only messages after the last replayed one are fetched, oldest first and a page at a time, and the
+        guild's checkpoint is saved after every page so an interrupted replay picks up where it stopped.
+        '''
+        checkpoint_name = f"{REPLAY_CHECKPOINT}:{mod_channel.guild.id}"
+        checkpoint = await self.db.read(database.get_checkpoint, checkpoint_name)
+        if checkpoint is None:
+            # replays from before checkpoints were kept per guild
+            checkpoint = await self.db.read(database.get_checkpoint, REPLAY_CHECKPOINT)
+        after = discord.Object(id=checkpoint) if checkpoint is not None else None
+
+        start = time.perf_counter()
+        seen = adopted = 0
+        async for message in mod_channel.history(limit=replay_limit, after=after, oldest_first=True):
+            seen += 1
+            if message.author == self.user and message.id not in self.open_threads and message.reactions:
                 db_entry = database.Entry()
                 db_entry.fill_information(message, message.id)
-                self.open_entries[message.id] = db_entry
-                self.open_threads[message.id] = str(message.id)
+                offered = {str(reaction.emoji) for reaction in message.reactions if reaction.me}
+                step = workflow.infer_step(db_entry, offered)
+                self.restore_report(message.id, message.id, step, workflow.HISTORY_EMOJI not in offered, db_entry)
+                await self.db.write(database.open_report, message.id, message.id, step.name, mod_channel.guild.id)
+                if workflow.HISTORY_EMOJI not in offered:
+                    await self.db.write(database.set_history_shown, message.id)
+                adopted += 1
+            if seen % REPLAY_PAGE_SIZE == 0:
+                await self.db.write(database.set_checkpoint, checkpoint_name, message.id)
+
+        if seen:
+            await self.db.write(database.set_checkpoint, checkpoint_name, message.id)
+        elapsed = time.perf_counter() - start
+        rate = seen / elapsed if elapsed > 0 else 0.0
+        print(f"Replayed {seen} mod channel messages in {mod_channel.guild.name} ({adopted} reports adopted) "
+              f"in {elapsed:.2f}s, {rate:.0f} msg/s")
+
+    def register_guild(self, guild):
+        # Find the mod channel and the moderated channel in a guild that this bot should report to
+        for channel in guild.text_channels:
+            if channel.name == f'group-{self.group_num}-mod':
+                self.mod_channels[guild.id] = channel
+            if channel.name == f"group-{self.group_num}":
+                self.main_channels[guild.id] = channel.id
+                print(f"main channel found in {guild.name}")
+
+    async def save_guild_channels(self, guild_id):
+        mod_channel = self.mod_channels.get(guild_id)
+        await self.db.write(database.set_guild_channels, guild_id,
+                            mod_channel.id if mod_channel is not None else None, self.main_channels.get(guild_id))
+
+    async def known_guild(self, guild_id):
+        # a guild served by this process, or by another shard process sharing reports.db
+        if self.get_guild(guild_id) is not None:
+            return True
+        return (await self.db.read(database.get_guild_channels, guild_id)) is not None
+
+    async def report_channel(self, guild_id, channel_id):
+        guild = self.get_guild(guild_id)
+        if guild is not None:
+            return guild.get_channel(channel_id)
+        # another process's guild: not in this process's cache, but reachable over REST
+        try:
+            return await self.fetch_channel(channel_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+
+    async def mod_channel_for(self, guild_id):
+        if guild_id in self.mod_channels:
+            return self.mod_channels[guild_id]
+        channels = await self.db.read(database.get_guild_channels, guild_id)
+        if channels is None or channels[0] is None:
+            return None
+        return await self.fetch_channel(channels[0])
 
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
@@ -58,27 +226,33 @@ class ModBot(discord.Client):
         else:
             raise Exception("Group number not found in bot's name. Name format should be \"Group # Bot\".")
 
-        # Find the mod channel in each guild that this bot should report to
+        # With AutoShardedClient this runs once every shard of this process is ready
         for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f'group-{self.group_num}-mod':
-                    self.mod_channels[guild.id] = channel
-                if channel.name == f"group-{self.group_num}":
-                    self.main_channel = channel.id
-                    print("main channel found")
-
-        # Open DB
-        self.db = sl.connect("reports.db")
-        if self.db is not None:
-            try:
-                cursor = self.db.cursor()
-                cursor.execute(database.CREATE_REPORTS_DB)
-                self.db.commit()
-                cursor.close()
-            except sl.Error as e:
-                print(e)
-        else:
-            print("An error has occured getting the database reference!")
+            self.register_guild(guild)
+
+        # Open DB before the scoring workers, which write scores: migrations run on the writer
+        # thread before any other write
+        try:
+            await self.db.start(migrations.migrate)
+        except sl.Error as e:
+            # Nothing works without reports.db, so shut down rather than run with a dead writer
+            print(f"Could not open {self.db.path}: {e}")
+            await self.close()
+            return
+
+        # Start the scorer (for Perspective, its shared session) and the scoring workers
+        await self.scorer.start()
+        await self.pipeline.start()
+        if self.session_sweeper is None:
+            self.session_sweeper = asyncio.ensure_future(self.reports.run())
+        if not self.metrics_tasks:
+            self.metrics_tasks.append(asyncio.ensure_future(metrics.watch_loop_lag(self.loop_lag, self.current_loop_lag)))
+        if metrics_port is not None and self.metrics_runner is None:
+            self.metrics_runner = await metrics.serve(self.metrics, metrics_host, metrics_port)
+            print(f"Serving metrics on http://{metrics_host}:{metrics_port}/metrics")
+
+        for guild_id in set(self.mod_channels) | set(self.main_channels):
+            await self.save_guild_channels(guild_id)
 
         # response = input("Would you like to delete old reports? (yes/no) ")
         # while response != "yes" and response != "no":
@@ -94,315 +268,175 @@ class ModBot(discord.Client):
 
         print('Press Ctrl-C to quit.')
 
-    def send_thread_message(self, thread_id, message):
-        requests.post(
-            f"https://discord.com/api/v9/channels/{thread_id}/messages",
-            json={"content": message}, headers=self.header
-        )
+    async def on_shard_ready(self, shard_id):
+        print(f"Shard {shard_id} of {self.shard_count} is ready")
+
+    async def on_guild_join(self, guild):
+        if self.group_num is not None:
+            self.register_guild(guild)
+            await self.save_guild_channels(guild.id)
+
+    async def on_guild_remove(self, guild):
+        self.mod_channels.pop(guild.id, None)
+        self.main_channels.pop(guild.id, None)
+
+    async def close(self):
+        if self.session_sweeper is not None:
+            self.session_sweeper.cancel()
+        for task in self.metrics_tasks:
+            task.cancel()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await self.pipeline.stop()
+        await self.scorer.close()
+        await self.perspective.close()
+        print(f"Pre-filter: {self.prefilter.stats()}")
+        print(f"Score cache: {self.score_cache.stats()}")
+        print(f"Message scores: {self.message_scores.stats()}")
+        self.score_cache.close()
+        await self.db.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        await super().close()
+
+    async def send_thread_message(self, thread_id, message):
+        await threads.send_message(self.http, thread_id, message)
 
     async def add_reactions(self, message, emojis):
+        # Discord shows reactions in the order they were added, so these stay one after another
+        offered = self.offered_reactions.setdefault(message.id, set())
         for emoji in emojis:
-            await message.add_reaction(emoji)
+            async with self.reaction_limit:
+                await message.add_reaction(emoji)
+            offered.add(emoji)
+
+    async def remove_reaction(self, message, emoji):
+        async with self.reaction_limit:
+            await message.remove_reaction(emoji, self.user)
 
     async def remove_reactions(self, message, emojis):
+        # Removals are independent, so send them together; discord.py holds them on the
+        # channel's reaction rate-limit bucket and retries on 429
+        offered = self.offered_reactions.setdefault(message.id, set())
         for emoji in emojis:
-            await message.remove_reaction(emoji, self.user)
+            offered.discard(emoji)
+        await asyncio.gather(*(self.remove_reaction(message, emoji) for emoji in emojis))
 
     async def shift_forward(self, to_remove, to_add, message, next_message):
-        await self.remove_reactions(message, to_remove)
-        await self.add_reactions(message, to_add)
-        self.send_thread_message(
-            self.open_threads[message.id],
-            next_message
-        )
-
-    async def on_raw_reaction_add(self, response):
-        # get the latest reaction
-        channel = await self.fetch_channel(response.channel_id)
-        if channel.name != f"group-{self.group_num}-mod": return
-
-        message = await channel.fetch_message(response.message_id)
-        if message.id not in self.open_threads: return
-
-        selected = [reaction.emoji for reaction in message.reactions if reaction.count > 1]
-        if len(selected) < 1: return
-
-        if selected[0] == '❕':
-            msg = self.open_entries[message.id].get_reported_history(self.db)
-            await self.shift_forward(
-                ['❕'],
-                [],
-                message,
-                msg
+        with self.handler_latency.time("shift_forward"):
+            await asyncio.gather(
+                self.remove_reactions(message, [emoji for emoji in to_remove if emoji not in to_add]),
+                self.add_reactions(message, to_add),
+                self.send_thread_message(self.open_threads[message.id], next_message)
             )
-            return
 
-        if selected[-1] == "👍":
-            if self.open_entries[message.id].reporter == None:
-                await self.shift_forward(
-                    ['👍', '👎'],
-                    ["1️⃣", "2️⃣", "3️⃣", "4️⃣"],
-                    message,
-                    "What category best describes this message?\n" +
-                    "1️⃣: Threat of Danger or Harm\n" +
-                    "2️⃣: Harassment\n" + "3️⃣: Spam\n" +
-                    "4️⃣: Suspicious Behavior\n"
+    async def on_raw_reaction_add(self, payload):
+        # Everything needed is in the payload, so reject the bot's own reactions, messages that aren't
+        # open reports and reactions the current step doesn't accept before doing any network I/O
+        if payload.user_id == self.user.id: return
+        if self.recorder is not None:
+            self.recorder.reaction(payload)
+        if payload.message_id not in self.open_threads: return
+
+        emoji = str(payload.emoji)
+        if emoji == workflow.HISTORY_EMOJI:
+            if emoji not in self.offered_reactions.get(payload.message_id, ()): return
+            transition = None
+        else:
+            transition = workflow.next_transition(self.report_steps.get(payload.message_id), emoji)
+            if transition is None: return
+
+        with self.handler_latency.time("on_raw_reaction_add"):
+            channel = self.get_channel(payload.channel_id) or await self.fetch_channel(payload.channel_id)
+            message = channel.get_partial_message(payload.message_id)
+
+            if transition is None:
+                await asyncio.gather(
+                    self.remove_reactions(message, [workflow.HISTORY_EMOJI]),
+                    self.send_history(self.open_entries[message.id], self.open_threads[message.id]),
+                    self.db.write(database.set_history_shown, message.id)
                 )
             else:
-                await self.shift_forward(
-                    ['👍', '👎'],
-                    ["🥾", "🔒", "👮", "🚮"],
-                    message,
-                    "Please react on the message with one of the following emojis to perform an" +
-                    " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                    "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-                )
-            return
-
-        elif selected[-1] == "👎":
-            await self.shift_forward(
-                ['👍', '👎'],
-                ["🤐", "🚮"],
-                message,
-                "If you would like to restrict this user from reporting, please react on the" +
-                " message with 🤐. If you would like to discard this report, react with 🚮."
-            )
-            return
-
-        if selected[-1] == "1️⃣":
-            await self.shift_forward(
-                ["1️⃣", "2️⃣", "3️⃣", "4️⃣"],
-                ['🔘', '🔴'],
-                message,
-                "Please select a subcategory.\n" + "🔘: Credible Threat of Violence\n" +
-                "🔴: Suicidal Comments\n"
-            )
-            return
-
-        if selected[-1] == "2️⃣":
-            await self.shift_forward(
-                ["1️⃣", "2️⃣", "3️⃣", "4️⃣"],
-                ['🟠', '🟡', '🟢'],
-                message,
-                "Please select a subcategory.\n" + "🟠: Sexual Harassment\n" +
-                "🟡: Hate Speech\n" + "🟢: Bullying"
-            )
-            return
-
-        if selected[-1] == "3️⃣":
-            await self.shift_forward(
-                ["1️⃣", "2️⃣", "3️⃣", "4️⃣"],
-                ['🔵', '🟣'],
-                message,
-                "Please select a subcategory.\n" + "🔵: Unwanted Solicitation\n" +
-                "🟣: Scam or Fradulent Business"
-            )
-            return
-
-        if selected[-1] == "4️⃣":
-            await self.shift_forward(
-                ["1️⃣", "2️⃣", "3️⃣", "4️⃣"],
-                ['⚫️', '⚪️', '🟤', '🔶'],
-                message,
-                "Please select a subcategory.\n" + "⚫️: Possible Grooming\n" +
-                "⚪️: Impersonation or Compromised Account\n" +
-                "🟤: Attempt to Solicit Personal Information\n" +
-                "🔶: Offer of Transportation"
-            )
-            return
-
-        if selected[-1] == '🔘':
-            await self.shift_forward(
-                ['🔘', '🔴'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🔘', message.id)
-            return
-
-        if selected[-1] == '🔴':
-            await self.shift_forward(
-                ['🔘', '🔴'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🔴', message.id)
-            return
+                await self.apply_transition(message, transition)
 
-        if selected[-1] == '🟠':
-            await self.shift_forward(
-                ['🟠', '🟡', '🟢', ],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🟠', message.id)
-            return
-
-        if selected[-1] == '🟡':
-            await self.shift_forward(
-                ['🟠', '🟡', '🟢', ],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🟡', message.id)
-            return
-
-        if selected[-1] == '🟢':
-            await self.shift_forward(
-                ['🟠', '🟡', '🟢'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🟢', message.id)
-            return
-
-        if selected[-1] == '🔵':
-            await self.shift_forward(
-                ['🔵', '🟣'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🔵', message.id)
-            return
-
-        if selected[-1] == '🟣':
-            await self.shift_forward(
-                ['🔵', '🟣'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🟣', message.id)
-            return
-
-        if selected[-1] == '⚫️':
-            await self.shift_forward(
-                ['⚫️', '⚪️', '🟤', '🔶'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '⚫️', message.id)
-            return
-
-        if selected[-1] == '⚪️':
-            await self.shift_forward(
-                ['⚫️', '⚪️', '🟤', '🔶'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '⚪️', message.id)
-            return
-
-        if selected[-1] == '🟤':
-            await self.shift_forward(
-                ['⚫️', '⚪️', '🟤', '🔶'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🟤', message.id)
-            return
-
-        if selected[-1] == '🔶':
-            await self.shift_forward(
-                ['⚫️', '⚪️', '🟤', '🔶'],
-                ["🥾", "🔒", "👮", "🚮"],
-                message,
-                "Please react on the message with one of the following emojis to perform an" +
-                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" +
-                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
-            )
-            database.update_categories(self.db, '🔶', message.id)
+    async def send_history(self, entry, thread_id):
+        '''
+        Posts the report history of the accounts involved in entry to its thread: a summary line, then
+        up to history_max_reports of the newest reports, one keyset-paginated page at a time.
+        '''
+        for header, column, account in entry.history_accounts():
+            total, resolved, categories = await self.db.read(database.get_history_summary, column, account)
+            summary = f"{header} {account}: {total} reports, {resolved} resolved"
+            if categories:
+                summary += " (" + ", ".join(f"{category}: {reports}" for category, reports in categories) + ")"
+            now = database.now()
+            for label, seconds in HISTORY_WINDOWS:
+                recent = await self.db.read(database.count_reports_since, column, account, now - seconds)
+                summary += f", {recent} in the last {label}"
+            await self.send_thread_message(thread_id, summary)
+
+            shown = 0
+            before_id = None
+            while shown < history_max_reports:
+                limit = min(database.HISTORY_PAGE_SIZE, history_max_reports - shown)
+                rows = await self.db.read(database.get_history_page, column, account, before_id, limit)
+                if not rows: break
+                blocks = [database.format_history_row(row, column) for row in rows]
+                for chunk in database.chunk_messages(blocks):
+                    await self.send_thread_message(thread_id, chunk)
+                shown += len(rows)
+                before_id = rows[-1][0]
+
+            if total > shown:
+                await self.send_thread_message(thread_id, f"...and {total - shown} older reports not shown.")
+
+    async def apply_transition(self, message, transition):
+        # Move the in-memory step first so a second click can't apply the same transition twice
+        self.report_steps[message.id] = transition.next_step
+        await self.shift_forward(transition.remove, transition.add, message, transition.prompt)
+
+        if transition.subcategory is not None:
+            await self.db.write(database.update_categories, transition.subcategory, message.id)
+
+        if transition.next_step != workflow.Step.RESOLVED:
+            await self.db.write(database.set_workflow_step, message.id, transition.next_step.name)
             return
 
-        action = None
-        if selected[-1] == "🥾":
-            action = "USER BANNED"
-            await self.remove_reactions(message, ["🥾", "🔒", "👮", "🚮"])
-            self.send_thread_message(self.open_threads[message.id], "User has been banned.")
-
-        elif selected[-1] == "🔒":
-            action = "USER RESTRICTED (MESSAGING)"
-            await self.remove_reactions(message, ["🥾", "🔒", "👮", "🚮"])
-            self.send_thread_message(self.open_threads[message.id], "User has been restricted.")
-
-        elif selected[-1] == "👮":
-            action = "AUTHORITIES ALERTED"
-            await self.remove_reactions(message, ["🥾", "🔒", "👮", "🚮"])
-            self.send_thread_message(self.open_threads[message.id], "Local authorities are being notified.")
-
-        elif selected[-1] == "🚮":
-            action = "REPORT DELETED (NO ACTION)"
-            await self.remove_reactions(message, ["🥾", "🔒", "👮", "🚮"])
-            self.send_thread_message(self.open_threads[message.id], "Message is being deleted.")
-
-        elif selected[-1] == "🤐":
-            action = "USER RESTRICTED (REPORTING)"
-            await self.remove_reactions(message, ["🥾", "🔒", "👮", "🚮"])
-            self.send_thread_message(self.open_threads[message.id], "User has been restricted from reporting.")
-
         # remove thread from list in bot and delete message. this does NOT delete the thread
-        database.update_resolution(self.db, action, message.id)
+        await self.db.write(database.update_resolution, transition.resolution, message.id)
+        await self.db.write(database.delete_workflow_step, message.id)
         del self.open_threads[message.id]
+        self.open_entries.pop(message.id, None)
+        self.offered_reactions.pop(message.id, None)
+        self.report_steps.pop(message.id, None)
         await message.delete()
 
     async def handle_mod_message(self, message):
-        header = {"Authorization": f"Bot {discord_token}", "Content-Type": "application/json"}
-        data = {"name": f"{message.id}", "auto_archive_duration": 60}
-        response = json.loads(requests.post(
-            f"https://discord.com/api/v9/channels/{message.channel.id}/messages/{message.id}/threads",
-            json=data, headers=header
-        ).content)
-
-        thread_id = response["id"]
-
-        response = json.loads(requests.post(
-            f"https://discord.com/api/v9/channels/{thread_id}/messages",
-            json={"content": "Is this a valid report? Please react on the outer message with 👍 or 👎.\n" +
-                             "You can view the report history with ❕."}, headers=header
-        ).content)
-
-        await self.add_reactions(message, ['👍', '👎'])
+        with self.handler_latency.time("handle_mod_message"):
+            await self.open_mod_report(message)
+
+    async def open_mod_report(self, message):
+        thread = await threads.start_thread(self.http, message.channel.id, message.id, f"{message.id}")
+        thread_id = thread["id"]
+
+        await self.send_thread_message(thread_id, workflow.REVIEW_PROMPT)
+
+        await self.add_reactions(message, workflow.REVIEW_EMOJIS)
         self.open_threads[message.id] = thread_id
 
         db_entry = database.Entry()
         db_entry.fill_information(message, thread_id)
-        db_entry.submit_entry(self.db)
+        await self.db.write(db_entry.submit_entry)
         self.open_entries[message.id] = db_entry
-        to_add = ['❕']
+        self.report_steps[message.id] = workflow.initial_step(db_entry)
+        await self.db.write(database.open_report, message.id, thread_id, self.report_steps[message.id].name,
+                            message.guild.id)
+        to_add = [workflow.HISTORY_EMOJI]
         await self.add_reactions(message, to_add)
 
         # if a single message is alerting reports from many users, automatically take it down
-        if (database.remove_report(self.db, db_entry.original_msg_id)):
-            channel = await self.fetch_channel(self.main_channel)
+        if (await self.db.read(database.remove_report, db_entry.original_msg_id)):
+            channel = await self.fetch_channel(self.main_channels[message.guild.id])
             reported_msg = await channel.fetch_message(db_entry.original_msg_id)
             await reported_msg.reply("This message has been automatically removed.")
 
@@ -417,6 +451,12 @@ class ModBot(discord.Client):
                                discord.channel.DMChannel) and message.channel.name == f"group-{self.group_num}-mod"
         )
 
+        if self.recorder is not None:
+            if not message.guild:
+                self.recorder.message(message, "dm", message.author.id == self.user.id)
+            elif is_mod_message or message.channel.name == f"group-{self.group_num}":
+                self.recorder.message(message, "mod" if is_mod_message else "main", message.author.id == self.user.id)
+
         # Ignore messages from the bot
         if (message.author.id == self.user.id) and (not is_mod_message):
             return
@@ -458,78 +498,117 @@ class ModBot(discord.Client):
 
         # # If the report is complete or cancelled, remove it from our map
         if report.report_complete():
-            # get mod channel
-            mod_channel = [v for v in self.mod_channels.values()
-                           if v.name == f"group-{self.group_num}-mod"
-                           ][0].id
-            mod_channel = await self.fetch_channel(mod_channel)
-
-            msg_channel = await self.fetch_channel(report.msg_channel_id)
-            message = await msg_channel.fetch_message(report.reported_msg)
-
-            # get scores and send to mod channel
-            scores = self.eval_text(message)
+            # Reports go to the mod channel of the guild the reported message is in, from the gateway cache
+            mod_channel = await self.mod_channel_for(report.message.guild_id)
+            if mod_channel is None:
+                await message.channel.send("That server has no moderator channel, so this report couldn't be delivered.")
+                self.reports.pop(author_id)
+                return
+
+            # The snapshot taken when the report started stands in for the message; no refetch
+            message = report.message
+            # get scores and send to mod channel; the message was most likely scored when it was posted
+            scores = await self.message_scores.lookup(message.id, message.content)
+            scorer = None
+            if scores is None:
+                scores, scorer = await self.eval_text(message)
             await mod_channel.send(
                 self.code_format(
                     json.dumps(scores, indent=2),
                     message, "manually", author_id, report.category, report.subcategory, report.additional_info, report.involve_authorities
                 )
             )
+            if scorer is not None:
+                await self.save_scores(message, scores, scorer)
 
         if report.report_complete() or report.state == State.REPORT_CANCEL:
             self.reports.pop(author_id)
 
     def should_flag(self, scores, type):
-        if scores["PROFANITY"] + scores["TOXICITY"] + scores["SEVERE_TOXICITY"] >= 2.8: return True
-        elif scores["FLIRTATION"] + scores["THREAT"] >= 0.8 and scores["THREAT"] > 0.3 : return True
-        elif scores["THREAT"] > 0.85: return True
-        elif scores["IDENTITY_ATTACK"] >= .825: return True
-        
-        if type == "large":
-            if scores["IDENTITY_ATTACK"] > .60: return True
-            if scores["SEVERE_TOXICITY"] > 0.8: return True
-
-        return False
+        # not every scorer produces every attribute; a missing one counts as 0
+        scores = {attr: scores.get(attr, 0.0) for attr in ATTRIBUTES}
+        return rules.should_flag(scores, type, self.flag_rules)
+
+    async def save_scores(self, message, scores, scorer):
+        # Only the configured scorer's scores are kept: fallback scores would pass for them when
+        # reused for a report, and would skew what backtest.py evaluates rules against
+        if scorer != self.scorer.name:
+            return
+        self.message_scores.remember(message.id, message.content, scores)
+        # Called after the mod channel post, so a failed write costs the stored copy, not the report
+        try:
+            await self.db.write(database.save_scores, message.id, message.author.id, scorer,
+                                len(message.content.split()), content_hash(message.content), scores)
+        except sl.Error as e:
+            print(f"Saving scores for message {message.id} failed: {e!r}")
+
+    async def load_message_scores(self, message_id):
+        return await self.db.read(database.get_message_scores, message_id)
     
     async def handle_channel_message(self, message):
         # Only handle messages sent in the "group-#" channel
         if not message.channel.name == f'group-{self.group_num}':
             return
 
+        # With the pre-filter opted in, skip clearly benign messages and escalate clear threats unscored
+        verdict, details = self.prefilter.classify(message.content)
+        if verdict == Verdict.BENIGN:
+            self.channel_messages.inc("skipped")
+            return
+        if verdict == Verdict.ESCALATE:
+            self.channel_messages.inc("escalated")
+            mod_channel = self.mod_channels[message.guild.id]
+            await mod_channel.send(self.code_format(json.dumps(details, indent=2), message, "automatically"))
+            return
+
+        # Queue the message for scoring; flag_channel_message is called once it has been scored
+        await self.pipeline.submit(message)
+
+    async def flag_channel_message(self, message, scored):
         # Forward the message to the mod channel
+        scores, scorer = scored
         mod_channel = self.mod_channels[message.guild.id]
-        scores = self.eval_text(message)
 
-        if len(message.content.split()) <= 15 and self.should_flag(scores, "small"):
+        if len(message.content.split()) <= self.flag_rules["max_small_words"] and self.should_flag(scores, "small"):
+            self.channel_messages.inc("flagged")
             await mod_channel.send(self.code_format(json.dumps(scores, indent=2), message, "automatically"))
         elif (self.should_flag(scores, "large")):
+            self.channel_messages.inc("flagged")
             await mod_channel.send(self.code_format(json.dumps(scores, indent=2), message, "automatically"))
+        else:
+            self.channel_messages.inc("unflagged")
 
-    def eval_text(self, message):
+        await self.save_scores(message, scores, scorer)
+
+    async def eval_text(self, message):
         '''
-        Given a message, forwards the message to Perspective and returns a dictionary of scores.
+        Given a message, scores it with the configured scorer and returns a dictionary of scores along
+        with the name of the scorer that produced them. Repeated content is answered from the score
+        cache. If the scorer fails and a fallback scorer is configured, the fallback's scores are
+        returned (and not cached).
         '''
-        PERSPECTIVE_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
-
-        url = PERSPECTIVE_URL + '?key=' + self.perspective_key
-        data_dict = {
-            'comment': {'text': message.content},
-            'languages': ['en'],
-            'requestedAttributes': {
-                'SEVERE_TOXICITY': {}, 'PROFANITY': {},
-                'IDENTITY_ATTACK': {}, 'THREAT': {},
-                'TOXICITY': {}, 'FLIRTATION': {}
-            },
-            'doNotStore': True
-        }
-        response = requests.post(url, data=json.dumps(data_dict))
-        response_dict = response.json()
-
-        scores = {}
-        for attr in response_dict["attributeScores"]:
-            scores[attr] = response_dict["attributeScores"][attr]["summaryScore"]["value"]
-
-        return scores
+        with self.handler_latency.time("eval_text"):
+            try:
+                scores = await self.score_cache.get_or_score(message.content, self.scorer.attributes, self.scorer.score)
+                return scores, self.scorer.name
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if self.fallback_scorer is None:
+                    raise
+                self.scorer_fallbacks.inc()
+                return await self.fallback_scorer.score(message.content), self.fallback_scorer.name
+
+    async def eval_batch(self, messages):
+        # eval_text for a whole pipeline batch, for scorers that score batches in one call
+        with self.handler_latency.time("eval_batch"):
+            attributes = self.scorer.attributes
+            results = [self.score_cache.get(message.content, attributes) for message in messages]
+            missing = [i for i, scores in enumerate(results) if scores is None]
+            if missing:
+                scored = await self.scorer.score_batch([messages[i].content for i in missing])
+                for i, scores in zip(missing, scored):
+                    self.score_cache.put(messages[i].content, attributes, scores)
+                    results[i] = scores
+            return [(scores, self.scorer.name) for scores in results]
 
     def code_format(self, text, message, method, author_id=None, category=None, subcategory=None, additional_info=None, involve_authorities=None):
         if method == "manually":
@@ -551,5 +630,10 @@ class ModBot(discord.Client):
         return toReturn
 
 
-client = ModBot(perspective_key)
-client.run(discord_token)
\ No newline at end of file
+if __name__ == "__main__":
+    listener = log_config.setup_logging(log_file, log_levels, log_sample, log_max_bytes, log_backups)
+    try:
+        client = ModBot(os.environ["perspective"])
+        client.run(os.environ["discord"])
+    finally:
+        listener.stop()
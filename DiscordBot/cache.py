@@ -0,0 +1,232 @@
+# cache.py
+import asyncio
+import hashlib
+import json
+import sqlite3 as sl
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CREATE_SCORE_CACHE_DB = """CREATE TABLE IF NOT EXISTS score_cache (
+                               key TEXT PRIMARY KEY,
+                               scores TEXT NOT NULL,
+                               expires REAL NOT NULL
+                           );"""
+
+SELECT_LIVE_SCORES = """SELECT key, scores, expires FROM score_cache WHERE expires > ?
+                        ORDER BY expires DESC LIMIT ?;"""
+UPSERT_CACHED_SCORES = """INSERT OR REPLACE INTO score_cache(key, scores, expires) VALUES (?, ?, ?);"""
+DELETE_EXPIRED_SCORES = """DELETE FROM score_cache WHERE expires <= ?;"""
+
+
+def normalize(text):
+    # Spam waves vary case and spacing, so collapse both before hashing
+    return " ".join(text.casefold().split())
+
+
+def cache_key(text, attributes, namespace=""):
+    raw = namespace + "\x00" + normalize(text) + "\x00" + ",".join(sorted(attributes))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    '''
+    Score cache keyed on normalized message content and the requested attribute set. Entries live in
+    an in-memory LRU bounded by max_entries and expire after ttl seconds. If db_path is given, entries
+    also survive restarts: the newest live entries in its SQLite table are loaded into the LRU at
+    startup, and new entries are written back in batches every flush_interval seconds on a background
+    thread. Lookups never touch SQLite, so neither does the event loop. namespace (the scorer's
+    name) keeps scores from different backends apart.
+    '''
+
+    def __init__(self, max_entries=10000, ttl=6 * 60 * 60, db_path=None, namespace="", flush_interval=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.namespace = namespace
+        self.entries = OrderedDict()  # key -> (expires, scores)
+        self.inflight = {}  # key -> future for a score request already on its way
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.flush_interval = flush_interval
+        self.pending = []  # (key, scores JSON, expires) rows not yet written
+        self.flush_handle = None
+        self.db = None
+        self.writer = None
+        if db_path is not None:
+            # only the writer thread uses the connection once it's loaded
+            self.db = sl.connect(db_path, check_same_thread=False)
+            self.db.execute(CREATE_SCORE_CACHE_DB)
+            self.db.execute(DELETE_EXPIRED_SCORES, (time.time(),))
+            self.db.commit()
+            self.load()
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="score-cache-writer")
+
+    def load(self):
+        rows = self.db.execute(SELECT_LIVE_SCORES, (time.time(), self.max_entries)).fetchall()
+        # oldest first, so the newest entries end up at the LRU's fresh end
+        for key, scores, expires in reversed(rows):
+            self.remember(key, json.loads(scores), expires)
+        self.loaded = len(rows)
+
+    def get(self, text, attributes):
+        key = cache_key(text, attributes, self.namespace)
+        now = time.time()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, text, attributes, scores):
+        key = cache_key(text, attributes, self.namespace)
+        expires = time.time() + self.ttl
+        self.remember(key, scores, expires)
+        if self.db is not None:
+            self.pending.append((key, json.dumps(scores), expires))
+            if self.flush_handle is None:
+                self.flush_handle = asyncio.get_event_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        if self.pending:
+            batch, self.pending = self.pending, []
+            self.writer.submit(self.write_batch, batch)
+
+    def write_batch(self, batch):
+        # Runs on the writer thread: one transaction, so one fsync, per batch
+        try:
+            self.db.executemany(UPSERT_CACHED_SCORES, batch)
+            self.db.commit()
+        except sl.Error as e:
+            print(f"Saving {len(batch)} cached scores failed: {e!r}")
+
+    def remember(self, key, scores, expires):
+        self.entries[key] = (expires, scores)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_score(self, text, attributes, score):
+        '''
+        Returns cached scores for text, calling the score coroutine on a miss. Identical messages that
+        arrive while a request is already in flight wait on that request instead of sending their own.
+        '''
+        scores = self.get(text, attributes)
+        if scores is not None:
+            return scores
+
+        key = cache_key(text, attributes, self.namespace)
+        if key in self.inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self.inflight[key])
+
+        future = asyncio.get_event_loop().create_future()
+        self.inflight[key] = future
+        try:
+            scores = await score(text)
+            self.put(text, attributes, scores)
+            future.set_result(scores)
+            return scores
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting on the future; retrieve the exception so asyncio doesn't warn
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "loaded": self.loaded,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        if self.db is not None:
+            if self.flush_handle is not None:
+                self.flush_handle.cancel()
+            self.flush()
+            self.writer.shutdown(wait=True)
+            self.writer = None
+            self.db.close()
+            self.db = None
+
+
+def content_hash(text):
+    # exact content, unlike cache_key: any edit at all means the stored scores are stale
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class MessageScoreStore:
+    '''
+    Scores keyed by message id, so a message that was scored when it was posted isn't scored again
+    when it is reported. Recent messages are kept in an in-memory LRU of max_entries; older ones are
+    read from the scores table through load, a coroutine called as load(message_id) that returns
+    (content_hash, scores) or None (e.g. AsyncDatabase.read of database.get_message_scores). A stored
+    entry only counts if the message's content still hashes the same, i.e. it wasn't edited since.
+    '''
+
+    def __init__(self, load, max_entries=10000):
+        self.load = load
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # message id -> (content hash, scores)
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.edited = 0
+
+    def remember(self, message_id, content, scores):
+        self.keep(message_id, (content_hash(content), scores))
+
+    def keep(self, message_id, entry):
+        self.entries[message_id] = entry
+        self.entries.move_to_end(message_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def lookup(self, message_id, content):
+        entry = self.entries.get(message_id)
+        from_db = False
+        if entry is None:
+            entry = await self.load(message_id)
+            from_db = entry is not None
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] != content_hash(content):
+            self.edited += 1
+            return None
+
+        self.hits += 1
+        if from_db:
+            self.db_hits += 1
+        self.keep(message_id, entry)
+        return entry[1]
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "edited": self.edited
+        }
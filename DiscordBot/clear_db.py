@@ -5,7 +5,16 @@ import sqlite3 as sl
 if __name__ == "__main__":
     connection = sl.connect("reports.db")
     cursor = connection.cursor()
-    cursor.execute("DROP TABLE reports_table")
+    cursor.execute("DROP TABLE IF EXISTS reports_table")
+    cursor.execute("DROP TABLE IF EXISTS workflow_table")
+    cursor.execute("DROP TABLE IF EXISTS checkpoints")
+    cursor.execute("DROP TABLE IF EXISTS guild_channels")
+    cursor.execute("DROP TABLE IF EXISTS scores")
+    cursor.execute("DROP TABLE IF EXISTS message_reporters")
+    cursor.execute("DROP TABLE IF EXISTS message_stats")
+    cursor.execute("DROP TABLE IF EXISTS account_stats")
+    # drop the version too, so the next start recreates the tables from the first migration
+    cursor.execute("DROP TABLE IF EXISTS schema_version")
     connection.commit()
     cursor.close()
-    connection.close()
\ No newline at end of file
+    connection.close()
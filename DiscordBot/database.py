@@ -1,38 +1,100 @@
 import re
 import datetime
 
-CREATE_REPORTS_DB = """CREATE TABLE IF NOT EXISTS reports_table (
-                            _id INTEGER PRIMARY KEY,
-                            category TEXT,
-                            subcategory TEXT,
-                            reporter INTEGER,
-                            reported_account INTEGER NOT NULL,
-                            original_msg_id INTEGER NOT NULL,
-                            mod_msg_id INTEGER NOT NULL,
-                            thread_id INTEGER NOT NULL,
-                            msg_content TEXT NOT NULL,
-                            time TIMESTAMP NOT NULL,
-                            additional_info TEXT,
-                            resolution TEXT
-                       );"""
-
 ADD_MANUAL_REPORT = """INSERT INTO reports_table(
                          category, subcategory, reporter, reported_account, 
                          original_msg_id, mod_msg_id, thread_id, 
-                         msg_content, time, additional_info
-                       ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
+                         msg_content, time, created_at, additional_info
+                       ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
 
 ADD_AUTOMATIC_REPORT = """INSERT INTO reports_table(
                               reported_account, original_msg_id,
-                              mod_msg_id, thread_id, msg_content, time
-                          ) VALUES (?, ?, ?, ?, ?, ?);"""
+                              mod_msg_id, thread_id, msg_content, time, created_at
+                          ) VALUES (?, ?, ?, ?, ?, ?, ?);"""
 
 ADD_RESOLUTION = """UPDATE reports_table SET resolution = ? WHERE mod_msg_id = ?;"""
 
 ADD_CATEGORIES = """UPDATE reports_table SET category = ?, subcategory = ? WHERE mod_msg_id = ?;"""
 
-SELECT_REPORTER_HISTORY = """SELECT * FROM reports_table WHERE reporter = ?;"""
-SELECT_REPORTED_HISTORY = """SELECT * FROM reports_table WHERE reported_account = ?;"""
+# workflow_table doubles as the registry of open reports: a row exists from handle_mod_message
+# until the report is resolved, with the report's thread, step and whether ❕ has been used.
+# CROSS JOIN keeps SQLite scanning the (small) registry and probing reports_table by index.
+OPEN_REPORT = """INSERT OR REPLACE INTO workflow_table(mod_msg_id, step, thread_id, guild_id, history_shown, created_at)
+                 VALUES (?, ?, ?, ?, 0, IFNULL((SELECT MAX(created_at) FROM reports_table WHERE mod_msg_id = ?),
+                                            CAST(strftime('%s', 'now') AS INTEGER)));"""
+SET_WORKFLOW_STEP = """UPDATE workflow_table SET step = ? WHERE mod_msg_id = ?;"""
+SET_HISTORY_SHOWN = """UPDATE workflow_table SET history_shown = 1 WHERE mod_msg_id = ?;"""
+DELETE_WORKFLOW_STEP = """DELETE FROM workflow_table WHERE mod_msg_id = ?;"""
+SELECT_OPEN_REPORTS = """SELECT w.mod_msg_id, IFNULL(w.thread_id, w.mod_msg_id), w.step, w.history_shown,
+                                r.reporter, r.reported_account, r.original_msg_id, r.msg_content, r.created_at,
+                                r.category, r.subcategory, r.additional_info, w.guild_id
+                         FROM workflow_table w CROSS JOIN reports_table r ON r.mod_msg_id = w.mod_msg_id;"""
+
+SET_CHECKPOINT = """INSERT OR REPLACE INTO checkpoints(name, value) VALUES (?, ?);"""
+SELECT_CHECKPOINT = """SELECT value FROM checkpoints WHERE name = ?;"""
+
+# Every bot process records the channels of the guilds it serves, so a process that receives a DM
+# report about a guild served by another shard can still deliver it
+SET_GUILD_CHANNELS = """INSERT OR REPLACE INTO guild_channels(guild_id, mod_channel_id, main_channel_id) VALUES (?, ?, ?);"""
+SELECT_GUILD_CHANNELS = """SELECT mod_channel_id, main_channel_id FROM guild_channels WHERE guild_id = ?;"""
+
+# Scores for every message the bot scored, one column per attribute, so they can be queried and
+# backtested against moderator resolutions (see backtest.py)
+SCORE_ATTRIBUTES = ('SEVERE_TOXICITY', 'PROFANITY', 'IDENTITY_ATTACK', 'THREAT', 'TOXICITY', 'FLIRTATION')
+SAVE_SCORES = """INSERT OR REPLACE INTO scores(message_id, author_id, scorer, word_count, created_at, content_hash,
+                                             severe_toxicity, profanity, identity_attack, threat, toxicity, flirtation)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
+SELECT_MESSAGE_SCORES = """SELECT content_hash, severe_toxicity, profanity, identity_attack, threat, toxicity, flirtation
+                           FROM scores WHERE message_id = ?;"""
+
+# Each scored message with the outcome of the reports on it: 1 if a moderator acted on any of them,
+# 0 if every resolved report ended without action, NULL if it was never reported or not yet resolved
+SELECT_SCORED_OUTCOMES = """SELECT s.word_count, s.created_at, s.severe_toxicity, s.profanity, s.identity_attack,
+                                   s.threat, s.toxicity, s.flirtation,
+                                   (SELECT MAX(CASE WHEN r.resolution IN ({actions}) THEN 1
+                                                    WHEN r.resolution IS NOT NULL THEN 0 END)
+                                    FROM reports_table r WHERE r.original_msg_id = s.message_id)
+                            FROM scores s WHERE s.created_at >= ?;"""
+ACTION_RESOLUTIONS = ("USER BANNED", "USER RESTRICTED (MESSAGING)", "AUTHORITIES ALERTED")
+
+# Keyset pagination: newest first, each page starts below the last _id of the previous one
+SELECT_REPORTER_PAGE = """SELECT _id, category, subcategory, reported_account, msg_content, created_at, additional_info, resolution
+                          FROM reports_table WHERE reporter = ? AND _id < ? ORDER BY _id DESC LIMIT ?;"""
+SELECT_REPORTED_PAGE = """SELECT _id, category, subcategory, reporter, msg_content, created_at, additional_info, resolution
+                          FROM reports_table WHERE reported_account = ? AND _id < ? ORDER BY _id DESC LIMIT ?;"""
+
+# Time windows are range scans over the created_at indexes (integer seconds since the epoch)
+COUNT_REPORTED_SINCE = """SELECT COUNT(*) FROM reports_table WHERE reported_account = ? AND created_at >= ?;"""
+COUNT_REPORTER_SINCE = """SELECT COUNT(*) FROM reports_table WHERE reporter = ? AND created_at >= ?;"""
+SELECT_OPEN_REPORTS_BEFORE = """SELECT mod_msg_id, created_at FROM workflow_table WHERE created_at < ? ORDER BY created_at;"""
+
+# column -> (page query, label of the other account in each row)
+HISTORY_QUERIES = {
+     "reporter": (SELECT_REPORTER_PAGE, "Reported Account"),
+     "reported_account": (SELECT_REPORTED_PAGE, "Reporter")
+}
+
+# Aggregates kept up to date in the same transaction as every insert and resolution, so the
+# auto-removal check and history summaries don't have to count reports_table rows.
+# message_reporters holds each distinct (message, reporter) pair and message_stats its count;
+# account_stats counts reports per account, role ("reporter" or "reported_account"),
+# category and resolution ('' while unset).
+ADD_MESSAGE_REPORTER = """INSERT OR IGNORE INTO message_reporters(original_msg_id, reporter) VALUES (?, ?);"""
+BUMP_MESSAGE_STATS = """INSERT INTO message_stats(original_msg_id, reporters) VALUES (?, 1)
+                        ON CONFLICT(original_msg_id) DO UPDATE SET reporters = reporters + 1;"""
+SELECT_MESSAGE_REPORTERS = """SELECT reporters FROM message_stats WHERE original_msg_id = ?;"""
+
+BUMP_ACCOUNT_STATS = """INSERT INTO account_stats(account, role, category, resolution, reports) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(account, role, category, resolution) DO UPDATE SET reports = reports + excluded.reports;"""
+SELECT_REPORT_BUCKETS = """SELECT reporter, reported_account, category, resolution FROM reports_table WHERE mod_msg_id = ?;"""
+SELECT_ACCOUNT_SUMMARY = """SELECT IFNULL(SUM(reports), 0), IFNULL(SUM(CASE WHEN resolution != '' THEN reports ELSE 0 END), 0)
+                            FROM account_stats WHERE account = ? AND role = ?;"""
+SELECT_ACCOUNT_CATEGORIES = """SELECT category, SUM(reports) FROM account_stats WHERE account = ? AND role = ?
+                               GROUP BY category HAVING SUM(reports) > 0 ORDER BY SUM(reports) DESC;"""
+
+HISTORY_PAGE_SIZE = 5
+DISCORD_MESSAGE_LIMIT = 2000
+MAX_QUOTED_CONTENT = 300
 
 CATEGORIES = {
      "1️⃣": "Threat of Danger or Harm", 
@@ -71,28 +133,215 @@ def update_categories(db, emoji, mod_msg_id):
                subcategory = SUBCATEGORIES[emoji]
 
           cursor = db.cursor()
+          bump_report_buckets(cursor, mod_msg_id, -1)
           cursor.execute(ADD_CATEGORIES, (category, subcategory, mod_msg_id))
+          bump_report_buckets(cursor, mod_msg_id, 1)
           db.commit()
 
 def update_resolution(db, action, mod_msg_id):
      cursor = db.cursor()
+     bump_report_buckets(cursor, mod_msg_id, -1)
      cursor.execute(ADD_RESOLUTION, (action, mod_msg_id))
+     bump_report_buckets(cursor, mod_msg_id, 1)
      db.commit()
      cursor.close()
 
-def remove_report(db, reported_msg_id):
+def bump_account_stats(cursor, reporter, reported_account, category, resolution, delta):
+     bucket = (category or "", resolution or "", delta)
+     cursor.execute(BUMP_ACCOUNT_STATS, (reported_account, "reported_account") + bucket)
+     if reporter is not None:
+          cursor.execute(BUMP_ACCOUNT_STATS, (reporter, "reporter") + bucket)
+
+def bump_report_buckets(cursor, mod_msg_id, delta):
+     # moving a report between category/resolution buckets is a -1 before the update and a +1 after
+     cursor.execute(SELECT_REPORT_BUCKETS, (mod_msg_id,))
+     for reporter, reported_account, category, resolution in cursor.fetchall():
+          bump_account_stats(cursor, reporter, reported_account, category, resolution, delta)
+
+def record_report(cursor, reporter, reported_account, original_msg_id, category):
+     bump_account_stats(cursor, reporter, reported_account, category, None, 1)
+     if reporter is not None:
+          cursor.execute(ADD_MESSAGE_REPORTER, (original_msg_id, reporter))
+          if cursor.rowcount == 1:
+               cursor.execute(BUMP_MESSAGE_STATS, (original_msg_id,))
+
+def open_report(db, mod_msg_id, thread_id, step, guild_id=None):
+     cursor = db.cursor()
+     cursor.execute(OPEN_REPORT, (mod_msg_id, step, thread_id, guild_id, mod_msg_id))
+     db.commit()
+     cursor.close()
+
+def set_workflow_step(db, mod_msg_id, step):
+     cursor = db.cursor()
+     cursor.execute(SET_WORKFLOW_STEP, (step, mod_msg_id))
+     db.commit()
+     cursor.close()
+
+def set_history_shown(db, mod_msg_id):
+     cursor = db.cursor()
+     cursor.execute(SET_HISTORY_SHOWN, (mod_msg_id,))
+     db.commit()
+     cursor.close()
+
+def delete_workflow_step(db, mod_msg_id):
+     cursor = db.cursor()
+     cursor.execute(DELETE_WORKFLOW_STEP, (mod_msg_id,))
+     db.commit()
+     cursor.close()
+
+def get_open_reports(db, guild_ids=None):
+     # rows of (mod_msg_id, thread_id, step, history_shown, Entry) for every unresolved report, or only
+     # those in guild_ids (plus reports from before guilds were recorded) when several processes share the db
+     cursor = db.cursor()
+     cursor.execute(SELECT_OPEN_REPORTS)
+     results = cursor.fetchall()
+     cursor.close()
+
+     open_reports = []
+     for row in results:
+          if guild_ids is not None and row[12] is not None and row[12] not in guild_ids:
+               continue
+          entry = Entry()
+          entry.load_row(row)
+          open_reports.append((row[0], row[1], row[2], bool(row[3]), entry))
+     return open_reports
+
+def set_checkpoint(db, name, value):
+     cursor = db.cursor()
+     cursor.execute(SET_CHECKPOINT, (name, value))
+     db.commit()
+     cursor.close()
+
+def get_checkpoint(db, name):
+     cursor = db.cursor()
+     cursor.execute(SELECT_CHECKPOINT, (name,))
+     result = cursor.fetchone()
+     cursor.close()
+     return None if result is None else result[0]
+
+def set_guild_channels(db, guild_id, mod_channel_id, main_channel_id):
      cursor = db.cursor()
-     cursor.execute(
-          f"""SELECT COUNT(DISTINCT reporter) 
-          FROM reports_table 
-          WHERE original_msg_id = {reported_msg_id};"""
-     )
-     result = cursor.fetchall()[0][0]
+     cursor.execute(SET_GUILD_CHANNELS, (guild_id, mod_channel_id, main_channel_id))
      db.commit()
      cursor.close()
-     return result >= 2
+
+def get_guild_channels(db, guild_id):
+     # (mod_channel_id, main_channel_id) recorded for the guild, or None if no bot process serves it
+     cursor = db.cursor()
+     cursor.execute(SELECT_GUILD_CHANNELS, (guild_id,))
+     result = cursor.fetchone()
+     cursor.close()
+     return result
+
+def get_history_summary(db, column, account):
+     cursor = db.cursor()
+     cursor.execute(SELECT_ACCOUNT_SUMMARY, (account, column))
+     total, resolved = cursor.fetchone()
+     cursor.execute(SELECT_ACCOUNT_CATEGORIES, (account, column))
+     categories = [(category or "Uncategorized", reports) for category, reports in cursor.fetchall()]
+     cursor.close()
+     return total, resolved, categories
+
+def count_reports_since(db, column, account, since):
+     cursor = db.cursor()
+     cursor.execute(COUNT_REPORTER_SINCE if column == "reporter" else COUNT_REPORTED_SINCE, (account, since))
+     result = cursor.fetchone()[0]
+     cursor.close()
+     return result
+
+def get_open_reports_before(db, before):
+     # (mod_msg_id, created_at) of open reports created before the given epoch time, oldest first
+     cursor = db.cursor()
+     cursor.execute(SELECT_OPEN_REPORTS_BEFORE, (before,))
+     results = cursor.fetchall()
+     cursor.close()
+     return results
+
+def save_scores(db, message_id, author_id, scorer, word_count, content_hash, scores):
+     cursor = db.cursor()
+     cursor.execute(SAVE_SCORES, (message_id, author_id, scorer, word_count, now(), content_hash)
+                    + tuple(scores.get(attr) for attr in SCORE_ATTRIBUTES))
+     db.commit()
+     cursor.close()
+
+def get_message_scores(db, message_id):
+     # (content_hash, scores) stored for the message, or None if it was never scored
+     cursor = db.cursor()
+     cursor.execute(SELECT_MESSAGE_SCORES, (message_id,))
+     result = cursor.fetchone()
+     cursor.close()
+     if result is None:
+          return None
+     return result[0], {attr: value for attr, value in zip(SCORE_ATTRIBUTES, result[1:]) if value is not None}
+
+def get_scored_outcomes(db, since=0):
+     # rows of (word_count, created_at, *scores in SCORE_ATTRIBUTES order, outcome) for messages scored since the given epoch
+     cursor = db.cursor()
+     cursor.execute(SELECT_SCORED_OUTCOMES.format(actions=", ".join("?" * len(ACTION_RESOLUTIONS))),
+                    ACTION_RESOLUTIONS + (since,))
+     results = cursor.fetchall()
+     cursor.close()
+     return results
+
+def now():
+     return int(datetime.datetime.now().timestamp())
+
+def format_time(created_at):
+     if created_at is None:
+          return None
+     return datetime.datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M:%S")
+
+def get_history_page(db, column, account, before_id=None, limit=HISTORY_PAGE_SIZE):
+     if before_id is None:
+          before_id = 2 ** 63 - 1
+     cursor = db.cursor()
+     cursor.execute(HISTORY_QUERIES[column][0], (account, before_id, limit))
+     results = cursor.fetchall()
+     cursor.close()
+     return results
+
+def format_history_row(row, column):
+     _id, category, subcategory, other_account, msg_content, created_at, additional_info, resolution = row
+     if len(msg_content) > MAX_QUOTED_CONTENT:
+          msg_content = msg_content[:MAX_QUOTED_CONTENT] + "..."
+
+     to_return = f"REPORT #{_id}\n"
+     to_return += f"----Category: {category}\n"
+     to_return += f"----Subcategory: {subcategory}\n"
+     to_return += f"----{HISTORY_QUERIES[column][1]}: {other_account}\n"
+     to_return += f"----Message: \"{msg_content}\"\n"
+     to_return += f"----Time: {format_time(created_at)}\n"
+     to_return += f"----Additional Information: {additional_info}\n"
+     to_return += f"----Resolution: {resolution}\n"
+     return to_return
+
+def chunk_messages(blocks, limit=DISCORD_MESSAGE_LIMIT):
+     # pack blocks into as few messages as possible without splitting a block across messages
+     chunks = []
+     current = []
+     size = 0
+     for block in blocks:
+          block = block[:limit]
+          if current and size + 1 + len(block) > limit:
+               chunks.append("\n".join(current))
+               current, size = [], 0
+          size += len(block) + (1 if current else 0)
+          current.append(block)
+     if current:
+          chunks.append("\n".join(current))
+     return chunks
+
+def remove_report(db, reported_msg_id):
+     cursor = db.cursor()
+     cursor.execute(SELECT_MESSAGE_REPORTERS, (reported_msg_id,))
+     result = cursor.fetchone()
+     cursor.close()
+     return result is not None and result[0] >= 2
 
 class Entry():
+     __slots__ = ("reporter", "reported_acc", "original_msg_id", "mod_msg_id", "time", "resolution",
+                  "msg_content", "thread_id", "category", "subcategory", "additional_info")
+
      def __init__(self):
           self.reporter = None
           self.reported_acc = None
@@ -106,64 +355,12 @@ class Entry():
           self.subcategory = None
           self.additional_info = None
 
-     def get_reporter_history(self, db):
-          cursor = db.cursor()
-          cursor.execute(
-               f"SELECT * FROM reports_table WHERE reporter = {self.reporter};"
-          )
-          results = cursor.fetchall()
-          cursor.close()
-
-          to_return = "REPORTER ACC\n"
-          for i in range(len(results)):
-               result = results[i]
-               if i < len(results) - 1:
-                    to_return += "\n"
-               to_return += f"REPORT #{result[0]}\n"
-               to_return += f"----Category: {result[1]}\n"
-               to_return += f"----Subcategory: {result[2]}\n"
-               to_return += f"----Reported Account: {result[4]}\n"
-               to_return += f"----Message: \"{result[-4]}\"\n"
-
-               time = result[-3].split(' ')
-               time[1] = time[1].split('.')[0]
-               time = datetime.datetime.strptime(f"{time[0]} {time[1]}", "%Y-%m-%d %H:%M:%S")
-               to_return += f'----Time: {time}\n'
-               to_return += f"----Additional Information: {result[-2]}\n"
-               to_return += f"----Resolution: {result[-1]}\n"
-
-          return to_return
-
-
-     def get_reported_history(self, db):
-          cursor = db.cursor()
-          cursor.execute(
-               f"SELECT * FROM reports_table WHERE reported_account = {self.reported_acc};"    
-          )
-          results = cursor.fetchall()
-          cursor.close()
-
-          to_return = "REPORTED ACC\n"
-          for i in range(len(results)):
-               result = results[i]
-               if i != 0:
-                    to_return += "\n"
-               to_return += f"REPORT #{result[0]}\n"
-               to_return += f"----Category: {result[1]}\n"
-               to_return += f"----Subcategory: {result[2]}\n"
-               to_return += f"----Reporter: {result[3]}\n"
-               to_return += f"----Message: \"{result[-4]}\"\n"
-
-               time = result[-3].split(' ')
-               time[1] = time[1].split('.')[0]
-               time = datetime.datetime.strptime(f"{time[0]} {time[1]}", "%Y-%m-%d %H:%M:%S")
-               to_return += f'----Time: {time}\n'
-               to_return += f"----Additional Information: {result[-2]}\n"
-               to_return += f"----Resolution: {result[-1]}\n"
-
-          if self.reporter != None: to_return += "\n" + self.get_reporter_history(db) + "\n"
-
-          return to_return
+     def history_accounts(self):
+          # (header, column, account) for each history shown when a moderator reacts with ❕
+          accounts = [("REPORTED ACC", "reported_account", self.reported_acc)]
+          if self.reporter != None:
+               accounts.append(("REPORTER ACC", "reporter", self.reporter))
+          return accounts
 
      def fill_information(self, message, thread_id):
           lines = [line.strip() for line in message.content.splitlines() if line][:5]
@@ -178,7 +375,7 @@ class Entry():
 
           # get category / subcategory
           categories = re.fullmatch(
-               "Category: (\w+) Subcategory: (\w+)",
+               "Category: (.+) Subcategory: (.+)",
                lines[3]
           )
           if categories != None:
@@ -194,18 +391,25 @@ class Entry():
           self.reported_acc = int(reported_msg_info.group(2))
 
           additional_info = re.fullmatch(
-               "Additional Info: ([\w ]+)",
+               "Additional Info: (.+)",
                lines[4]
           )
           if additional_info != None:
                self.additional_info = additional_info.group(1)
 
           # set the rest of the info
-          self.msg_content = lines[1].split(": ")[1]
-          self.time = datetime.datetime.now()
+          self.msg_content = lines[1].split(": ", 1)[1]
+          self.time = now()
           self.mod_msg_id = message.id
           self.thread_id = thread_id
 
+     def load_row(self, row):
+          # row as selected by SELECT_OPEN_REPORTS
+          self.mod_msg_id, self.thread_id = row[0], row[1]
+          self.reporter, self.reported_acc, self.original_msg_id = row[4], row[5], row[6]
+          self.msg_content, self.time = row[7], row[8]
+          self.category, self.subcategory, self.additional_info = row[9], row[10], row[11]
+
      def submit_entry(self, db):
           cursor = db.cursor()
           
@@ -213,15 +417,16 @@ class Entry():
                cursor.execute(
                     ADD_AUTOMATIC_REPORT,
                     (self.reported_acc, self.original_msg_id, self.mod_msg_id,
-                    self.thread_id, self.msg_content, self.time)
+                    self.thread_id, self.msg_content, self.time, self.time)
                )
           else:
                cursor.execute(
                     ADD_MANUAL_REPORT,
                     (self.category, self.subcategory, self.reporter, self.reported_acc, 
                     self.original_msg_id, self.mod_msg_id, self.thread_id, self.msg_content, 
-                    self.time, self.additional_info)
+                    self.time, self.time, self.additional_info)
                )
-          
+
+          record_report(cursor, self.reporter, self.reported_acc, self.original_msg_id, self.category)
           db.commit()
           cursor.close()
\ No newline at end of file
@@ -0,0 +1,276 @@
+# fakes.py
+'''
+In-process stand-ins for Discord and Perspective, so ModBot's handlers can be driven offline
+(see benchmark.py). Every fake Discord call sleeps for the configured latency to model a REST
+round-trip; messages the bot sends to a guild channel are echoed back to on_message the way the
+gateway would.
+'''
+import asyncio
+import hashlib
+import itertools
+import random
+import socket
+from aiohttp import web
+from bot import ModBot
+from perspective import ATTRIBUTES
+
+
+snowflakes = itertools.count(900000000000000000)
+
+
+class FakeDiscord:
+    def __init__(self, latency=0.0, jitter=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.pending = set()
+        self.calls = 0
+
+    async def round_trip(self):
+        self.calls += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    async def drain(self):
+        while self.pending:
+            await asyncio.gather(*list(self.pending), return_exceptions=True)
+
+
+class FakeUser:
+    def __init__(self, fake, name, user_id=None):
+        self.fake = fake
+        self.id = user_id if user_id is not None else next(snowflakes)
+        self.name = name
+        self.dm_channel = FakeDMChannel(fake, self)
+
+    async def send(self, content):
+        return await self.dm_channel.send(content)
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content, message_id=None):
+        self.id = message_id if message_id is not None else next(snowflakes)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.reactions = []
+        self.deleted = False
+
+    async def add_reaction(self, emoji):
+        await self.channel.fake.round_trip()
+
+    async def remove_reaction(self, emoji, member):
+        await self.channel.fake.round_trip()
+
+    async def delete(self):
+        await self.channel.fake.round_trip()
+        self.deleted = True
+        self.channel.messages.pop(self.id, None)
+
+    async def reply(self, content):
+        return await self.channel.send(content)
+
+
+class FakeChannel:
+    def __init__(self, fake, client, guild, name, channel_id=None):
+        self.fake = fake
+        self.client = client
+        self.guild = guild
+        self.name = name
+        self.id = channel_id if channel_id is not None else next(snowflakes)
+        self.messages = {}
+
+    def post(self, author, content, message_id=None):
+        # a message from someone else appearing in the channel, without a REST call
+        message = FakeMessage(self, author, content, message_id)
+        self.messages[message.id] = message
+        return message
+
+    async def send(self, content):
+        await self.fake.round_trip()
+        message = self.post(self.client.user, content)
+        self.fake.spawn(self.client.on_message(message))
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.fake.round_trip()
+        return self.messages[message_id]
+
+    def get_partial_message(self, message_id):
+        return self.messages[message_id]
+
+
+class FakeDMChannel:
+    name = None
+    guild = None
+
+    def __init__(self, fake, recipient):
+        self.fake = fake
+        self.recipient = recipient
+        self.id = next(snowflakes)
+        self.sent = []
+
+    async def send(self, content):
+        await self.fake.round_trip()
+        self.sent.append(content)
+
+    def post(self, author, content):
+        return FakeMessage(self, author, content)
+
+
+class FakeGuild:
+    def __init__(self, name, guild_id=None):
+        self.id = guild_id if guild_id is not None else next(snowflakes)
+        self.name = name
+        self.text_channels = []
+
+    def get_channel(self, channel_id):
+        for channel in self.text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+
+class FakeHTTP:
+    def __init__(self, fake):
+        self.fake = fake
+
+    async def request(self, route, json=None, **kwargs):
+        await self.fake.round_trip()
+        return {"id": str(next(snowflakes))}
+
+    async def close(self):
+        pass
+
+
+class FakePayload:
+    # the fields of discord.RawReactionActionEvent that on_raw_reaction_add reads
+    def __init__(self, channel_id, message_id, user_id, emoji):
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.emoji = emoji
+
+
+class FakeModBot(ModBot):
+    '''
+    ModBot wired to a FakeDiscord guild named after group_num, with "group-#" and "group-#-mod"
+    channels. Call setup() instead of connecting, then feed events to on_message and
+    on_raw_reaction_add directly.
+    '''
+
+    def __init__(self, fake, perspective_url, db_path, group_num=1):
+        super().__init__("fake-key", db_path=db_path)
+        self.fake = fake
+        self.http = FakeHTTP(fake)
+        self.perspective.url = perspective_url
+        self.fake_user = FakeUser(fake, f"Group {group_num} Bot")
+        self.fake_guild = FakeGuild(f"Group {group_num} Test Server")
+        self.fake_main = FakeChannel(fake, self, self.fake_guild, f"group-{group_num}")
+        self.fake_mod = FakeChannel(fake, self, self.fake_guild, f"group-{group_num}-mod")
+        self.fake_guild.text_channels = [self.fake_main, self.fake_mod]
+        self.fake_users = {}
+
+    @property
+    def user(self):
+        return self.fake_user
+
+    @property
+    def guilds(self):
+        return [self.fake_guild]
+
+    async def setup(self):
+        await self.on_ready()
+
+    def get_guild(self, guild_id):
+        return self.fake_guild if guild_id == self.fake_guild.id else None
+
+    def get_channel(self, channel_id):
+        return self.fake_guild.get_channel(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        await self.fake.round_trip()
+        return self.get_channel(channel_id)
+
+    async def fetch_user(self, user_id):
+        await self.fake.round_trip()
+        return self.fake_users[user_id]
+
+    def member(self, name):
+        user = FakeUser(self.fake, name)
+        self.fake_users[user.id] = user
+        return user
+
+    def message_link(self, message):
+        return f"https://discord.com/channels/{self.fake_guild.id}/{message.channel.id}/{message.id}"
+
+
+class PerspectiveStandIn:
+    '''
+    Local HTTP server speaking enough of the Perspective comments:analyze API for PerspectiveClient.
+    Scores are a deterministic function of the text, responses take latency (+ up to jitter)
+    seconds, and error_rate of requests fail with a 429 or 503.
+    '''
+
+    TOXIC_WORDS = ("kill", "hate", "stupid", "idiot", "hurt", "die", "ugly", "trash")
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.runner = None
+        self.url = None
+
+    def score(self, text, attributes):
+        words = text.lower().split()
+        toxic = sum(1 for word in words if word.strip(".,!?") in self.TOXIC_WORDS)
+        base = min(1.0, toxic / max(1, len(words)) * 3)
+        scores = {}
+        for attr in attributes:
+            noise = int(hashlib.md5((attr + text).encode("utf-8")).hexdigest()[:4], 16) / 0xFFFF
+            scores[attr] = round(min(1.0, base * 0.9 + noise * 0.1), 4)
+        return scores
+
+    async def analyze(self, request):
+        self.requests += 1
+        body = await request.json()
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": "stand-in failure"}, status=self.random.choice([429, 503]))
+
+        attributes = list(body.get("requestedAttributes", {})) or list(ATTRIBUTES)
+        scores = self.score(body["comment"]["text"], attributes)
+        return web.json_response({
+            "attributeScores": {attr: {"summaryScore": {"value": value, "type": "PROBABILITY"}}
+                                for attr, value in scores.items()}
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1alpha1/comments:analyze", self.analyze)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(self.runner, sock).start()
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}/v1alpha1/comments:analyze"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
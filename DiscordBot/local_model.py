@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# local_model.py
+'''
+In-process, CPU-only scoring backend. HashedNgramModel is a linear model over hashed word n-grams
+(and optionally character n-grams), one logistic output per Perspective attribute. A batch of
+texts is scored with a single gather and segment sum over the weight matrix, so scoring a burst
+costs about as much as scoring one message.
+
+Without a trained model file it falls back to a small built-in lexicon, which is enough to keep
+obvious abuse flowing to moderators during a Perspective outage. For real use, distill a model
+from Perspective scores:
+
+    python3 local_model.py train scored.jsonl model.npz   # lines of {"text": ..., "scores": {...}}
+'''
+import argparse
+import asyncio
+import json
+import re
+import zlib
+import numpy as np
+from perspective import ATTRIBUTES
+from scorer import Scorer
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+EXECUTOR_BATCH = 64  # batches at least this large are scored off the event loop
+
+# attribute -> phrases that push it up in the built-in model
+LEXICON = {
+    "TOXICITY": ["stupid", "idiot", "hate", "dumb", "trash", "ugly", "loser", "shut up", "pathetic",
+                 "worthless", "moron", "kill yourself", "kys"],
+    "SEVERE_TOXICITY": ["kill yourself", "kys", "go die", "worthless", "end your life"],
+    "PROFANITY": ["fuck", "shit", "bitch", "ass", "damn", "crap", "bastard", "whore", "slut"],
+    "THREAT": ["kill you", "hurt you", "shoot you", "stab you", "beat you", "i know where you live",
+               "you will regret", "watch your back", "end your life"],
+    "IDENTITY_ATTACK": ["your kind", "you people", "go back to your country", "subhuman"],
+    "FLIRTATION": ["sexy", "cute", "babe", "kiss", "send pics", "nudes", "hot"],
+}
+LEXICON_WEIGHT = 6.0
+LEXICON_BIAS = -3.0
+
+
+def hash_feature(feature, n_features):
+    # crc32 rather than hash(): str hashes are salted per process, and saved weights must line up
+    return zlib.crc32(feature.encode("utf-8")) % n_features
+
+
+class HashedNgramModel:
+    def __init__(self, attributes=ATTRIBUTES, n_features=2 ** 18, word_ngrams=2, char_ngrams=0,
+                 length_norm=True, weights=None, bias=None):
+        self.attributes = tuple(attributes)
+        self.n_features = n_features
+        self.word_ngrams = word_ngrams
+        self.char_ngrams = char_ngrams
+        self.length_norm = length_norm
+        self.weights = weights if weights is not None else np.zeros((n_features, len(self.attributes)), np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.attributes), np.float32)
+
+    def features(self, text):
+        '''
+        Hashed feature indices of text. Index 0 is always present, so no text has an empty row.
+        '''
+        tokens = TOKEN_RE.findall(text.lower())
+        features = [0]
+        for n in range(1, self.word_ngrams + 1):
+            for i in range(len(tokens) - n + 1):
+                features.append(hash_feature("w:" + " ".join(tokens[i:i + n]), self.n_features))
+        if self.char_ngrams:
+            for token in tokens:
+                padded = f"<{token}>"
+                for i in range(len(padded) - self.char_ngrams + 1):
+                    features.append(hash_feature("c:" + padded[i:i + self.char_ngrams], self.n_features))
+        return features
+
+    def encode(self, texts):
+        '''
+        Flattened feature indices of a batch, the offset of each text's run in them, each run's length,
+        and each run's weight: 1/sqrt(length) with length_norm, which keeps long messages from scoring
+        high on volume alone, otherwise 1.
+        '''
+        rows = [self.features(text) for text in texts]
+        lengths = np.fromiter((len(row) for row in rows), np.int64, len(rows))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        flat = np.fromiter((i for row in rows for i in row), np.int64, int(lengths.sum()))
+        scale = 1.0 / np.sqrt(lengths) if self.length_norm else np.ones(len(rows))
+        return flat, offsets, lengths, scale.astype(np.float32)
+
+    def predict(self, texts):
+        # (len(texts), len(attributes)) array of probabilities
+        if not texts:
+            return np.zeros((0, len(self.attributes)), np.float32)
+        flat, offsets, _, scale = self.encode(texts)
+        logits = np.add.reduceat(self.weights[flat], offsets, axis=0) * scale[:, None] + self.bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def fit(self, texts, targets, epochs=10, learning_rate=1.0, batch_size=256, l2=1e-6, seed=0):
+        '''
+        Logistic regression with soft labels: targets is a (len(texts), len(attributes)) array of
+        probabilities, e.g. Perspective's scores for the same texts.
+        '''
+        targets = np.asarray(targets, np.float32)
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(texts))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                flat, offsets, lengths, scale = self.encode([texts[i] for i in batch])
+                error = self.predict([texts[i] for i in batch]) - targets[batch]
+                gradient = np.zeros_like(self.weights)
+                np.add.at(gradient, flat, np.repeat(error * scale[:, None], lengths, axis=0))
+                self.weights -= learning_rate * (gradient / len(batch) + l2 * self.weights)
+                self.bias -= learning_rate * error.mean(axis=0)
+        return self
+
+    def scores(self, texts):
+        return [dict(zip(self.attributes, map(float, row))) for row in self.predict(texts)]
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, attributes=np.array(self.attributes),
+                            config=np.array([self.n_features, self.word_ngrams, self.char_ngrams, int(self.length_norm)]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        n_features, word_ngrams, char_ngrams, length_norm = (int(value) for value in data["config"])
+        return cls([str(attr) for attr in data["attributes"]], n_features, word_ngrams, char_ngrams,
+                   bool(length_norm), data["weights"], data["bias"])
+
+    @classmethod
+    def from_lexicon(cls, lexicon=LEXICON, attributes=ATTRIBUTES):
+        # any one phrase should carry its attribute whatever the message length, so no length_norm
+        model = cls(attributes, length_norm=False)
+        model.bias[:] = LEXICON_BIAS
+        for column, attr in enumerate(model.attributes):
+            for phrase in lexicon.get(attr, ()):
+                tokens = TOKEN_RE.findall(phrase)
+                # the phrase's own n-gram (e.g. "w:kill you"), or its longest n-grams split the weight
+                n = min(len(tokens), model.word_ngrams)
+                grams = [" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+                for gram in grams:
+                    model.weights[hash_feature("w:" + gram, model.n_features), column] += LEXICON_WEIGHT / len(grams)
+        return model
+
+
+class LocalScorer(Scorer):
+    '''
+    Scorer backed by a HashedNgramModel loaded from model_path, or the built-in lexicon model.
+    '''
+
+    name = "local"
+    batched = True
+
+    def __init__(self, model_path=None):
+        self.model = HashedNgramModel.load(model_path) if model_path else HashedNgramModel.from_lexicon()
+        self.attributes = self.model.attributes
+
+    async def score(self, text, attributes=None):
+        return (await self.score_batch([text], attributes))[0]
+
+    async def score_batch(self, texts, attributes=None):
+        if len(texts) >= EXECUTOR_BATCH:
+            scores = await asyncio.get_event_loop().run_in_executor(None, self.model.scores, list(texts))
+        else:
+            scores = self.model.scores(texts)
+        if attributes is not None:
+            scores = [{attr: row[attr] for attr in attributes if attr in row} for row in scores]
+        return scores
+
+
+def train(data_path, model_path, epochs, char_ngrams):
+    texts, targets = [], []
+    with open(data_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                texts.append(row["text"])
+                targets.append([row["scores"].get(attr, 0.0) for attr in ATTRIBUTES])
+    model = HashedNgramModel(char_ngrams=char_ngrams).fit(texts, targets, epochs=epochs)
+    model.save(model_path)
+    error = np.abs(model.predict(texts) - np.asarray(targets, np.float32)).mean(axis=0)
+    print(f"Trained on {len(texts)} texts; mean absolute error per attribute: "
+          + ", ".join(f"{attr} {value:.3f}" for attr, value in zip(ATTRIBUTES, error)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="fit a model to scored texts")
+    train_parser.add_argument("data", help='JSONL of {"text": ..., "scores": {attribute: probability}}')
+    train_parser.add_argument("model", help="where to write the model (.npz)")
+    train_parser.add_argument("--epochs", type=int, default=10)
+    train_parser.add_argument("--char-ngrams", type=int, default=4, help="character n-gram size (0 = off)")
+    score_parser = subparsers.add_parser("score", help="score texts with a model")
+    score_parser.add_argument("texts", nargs="+")
+    score_parser.add_argument("--model", default=None, help="model file (default: built-in lexicon)")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        train(args.data, args.model, args.epochs, args.char_ngrams)
+    else:
+        model = HashedNgramModel.load(args.model) if args.model else HashedNgramModel.from_lexicon()
+        for text, scores in zip(args.texts, model.scores(args.texts)):
+            print(json.dumps({"text": text, "scores": {attr: round(value, 4) for attr, value in scores.items()}}))
@@ -0,0 +1,104 @@
+# log_config.py
+'''
+Queued logging for the bot. Loggers hand records to a QueueHandler, which only appends them to an
+in-memory queue, and a QueueListener thread formats them and writes them to a size-rotated file.
+So a burst of gateway DEBUG lines costs the event loop only a %-merge each, not a full format
+and a disk write.
+Noisy loggers can be sampled, keeping one DEBUG record in N, before anything is queued.
+'''
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FORMAT = '%(asctime)s:%(levelname)s:%(name)s: %(message)s'
+
+
+def parse_mapping(spec, convert):
+    '''
+    "discord=DEBUG,discord.gateway=INFO" -> {"discord": "DEBUG", "discord.gateway": "INFO"},
+    with convert applied to each value.
+    '''
+    mapping = {}
+    for item in (spec or "").split(","):
+        if item.strip():
+            name, _, value = item.partition("=")
+            mapping[name.strip()] = convert(value.strip())
+    return mapping
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Keeps one in every N records at or below DEBUG from each configured logger (and its children);
+    other levels always pass.
+    '''
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates  # logger name -> N
+        self.seen = {}
+
+    def rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        n = self.rate(record.name)
+        if n <= 1:
+            return True
+        count = self.seen.get(record.name, 0)
+        self.seen[record.name] = count + 1
+        return count % n == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''
+    QueueHandler.prepare also applies the full formatter on the calling thread. Only merge the
+    %-args into the message and render the traceback there: args (often live gateway payload dicts)
+    and exc_info must not cross threads, but timestamps and the layout can wait for the listener.
+    '''
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(path="discord.log", levels=None, sample=None, max_bytes=10 * 1024 * 1024, backups=5):
+    '''
+    Routes the loggers named in levels (name -> level) through a queue to a RotatingFileHandler on
+    path. The previous run's log is rolled over to path.1 rather than overwritten. Returns the
+    started QueueListener; stop() it on shutdown to flush what's left in the queue.
+    '''
+    levels = levels or {"discord": "DEBUG"}
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                        encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        file_handler.doRollover()
+
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    if sample:
+        queue_handler.addFilter(SamplingFilter(sample))
+
+    for name, level in levels.items():
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        # child loggers propagate to the nearest configured ancestor, so only attach to the roots
+        if not any(name.startswith(other + ".") for other in levels):
+            logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,160 @@
+# metrics.py
+'''
+Minimal Prometheus instrumentation: counters, gauges and histograms kept in a Registry, rendered in
+the Prometheus text exposition format and served over HTTP by serve(). Metrics are plain in-process
+numbers updated from the event loop, so recording one costs a dict lookup and an addition.
+'''
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from aiohttp import web
+
+# seconds; spans a cache hit (sub-millisecond) through a slow Perspective call or Discord retry
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name + "_total", format_labels(self.labels, labels), value
+
+
+class Gauge:
+    '''
+    A value that is either set() directly or, if fn is given, read from fn() at scrape time (for
+    sizes of structures the bot already keeps, like len(self.open_threads)).
+    '''
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), fn=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.fn = fn
+        self.values = {}
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def samples(self):
+        if self.fn is not None:
+            yield self.name, "", self.fn()
+            return
+        for labels, value in sorted(self.values.items()):
+            yield self.name, format_labels(self.labels, labels), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield self.name + "_bucket", format_labels(self.labels, labels, [("le", format_value(bound))]), cumulative
+            yield self.name + "_sum", format_labels(self.labels, labels), total
+            yield self.name + "_count", format_labels(self.labels, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=(), fn=None):
+        return self.register(Gauge(name, description, labels, fn))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+async def watch_loop_lag(histogram, gauge, interval=0.5):
+    # a sleep that wakes up late means something held the event loop for the difference
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        histogram.observe(lag)
+        gauge.set(lag)
+
+
+async def serve(registry, host="127.0.0.1", port=9108):
+    '''
+    Serves registry.render() at http://host:port/metrics. Returns the aiohttp AppRunner; call its
+    cleanup() to stop.
+    '''
+    async def handle(request):
+        return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
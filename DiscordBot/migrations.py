@@ -0,0 +1,168 @@
+# migrations.py
+CREATE_SCHEMA_VERSION = """CREATE TABLE IF NOT EXISTS schema_version (
+                               version INTEGER NOT NULL
+                           );"""
+
+SELECT_SCHEMA_VERSION = """SELECT MAX(version) FROM schema_version;"""
+ADD_SCHEMA_VERSION = """INSERT INTO schema_version(version) VALUES (?);"""
+
+# (version, description, statements). Append new migrations to the end and never edit old ones;
+# databases created before versioning start at 0 and run every migration, so each step has to
+# be safe against tables that already exist. The SQL is written out here rather than taken from
+# database.py, so a later change there can't rewrite a migration that has already been applied.
+MIGRATIONS = [
+    (1, "base tables", [
+        """CREATE TABLE IF NOT EXISTS reports_table (
+               _id INTEGER PRIMARY KEY,
+               category TEXT,
+               subcategory TEXT,
+               reporter INTEGER,
+               reported_account INTEGER NOT NULL,
+               original_msg_id INTEGER NOT NULL,
+               mod_msg_id INTEGER NOT NULL,
+               thread_id INTEGER NOT NULL,
+               msg_content TEXT NOT NULL,
+               time TIMESTAMP NOT NULL,
+               additional_info TEXT,
+               resolution TEXT
+           );""",
+        """CREATE TABLE IF NOT EXISTS workflow_table (
+               mod_msg_id INTEGER PRIMARY KEY,
+               step TEXT NOT NULL
+           );"""
+    ]),
+    (2, "index report lookups", [
+        """CREATE INDEX IF NOT EXISTS reports_reporter_idx ON reports_table(reporter);""",
+        """CREATE INDEX IF NOT EXISTS reports_reported_account_idx ON reports_table(reported_account);""",
+        """CREATE INDEX IF NOT EXISTS reports_original_msg_idx ON reports_table(original_msg_id, reporter);""",
+        """CREATE INDEX IF NOT EXISTS reports_mod_msg_idx ON reports_table(mod_msg_id);"""
+    ]),
+    (3, "per-message and per-account report aggregates", [
+        """CREATE TABLE IF NOT EXISTS message_reporters (
+               original_msg_id INTEGER NOT NULL,
+               reporter INTEGER NOT NULL,
+               PRIMARY KEY (original_msg_id, reporter)
+           );""",
+        """CREATE TABLE IF NOT EXISTS message_stats (
+               original_msg_id INTEGER PRIMARY KEY,
+               reporters INTEGER NOT NULL
+           );""",
+        """CREATE TABLE IF NOT EXISTS account_stats (
+               account INTEGER NOT NULL,
+               role TEXT NOT NULL,
+               category TEXT NOT NULL,
+               resolution TEXT NOT NULL,
+               reports INTEGER NOT NULL,
+               PRIMARY KEY (account, role, category, resolution)
+           );""",
+        """INSERT OR IGNORE INTO message_reporters(original_msg_id, reporter)
+           SELECT original_msg_id, reporter FROM reports_table WHERE reporter IS NOT NULL;""",
+        """INSERT OR REPLACE INTO message_stats(original_msg_id, reporters)
+           SELECT original_msg_id, COUNT(*) FROM message_reporters GROUP BY original_msg_id;""",
+        """INSERT OR REPLACE INTO account_stats(account, role, category, resolution, reports)
+           SELECT reported_account, 'reported_account', IFNULL(category, ''), IFNULL(resolution, ''), COUNT(*)
+           FROM reports_table GROUP BY reported_account, IFNULL(category, ''), IFNULL(resolution, '');""",
+        """INSERT OR REPLACE INTO account_stats(account, role, category, resolution, reports)
+           SELECT reporter, 'reporter', IFNULL(category, ''), IFNULL(resolution, ''), COUNT(*)
+           FROM reports_table WHERE reporter IS NOT NULL
+           GROUP BY reporter, IFNULL(category, ''), IFNULL(resolution, '');"""
+    ]),
+    (4, "open report registry", [
+        """ALTER TABLE workflow_table ADD COLUMN thread_id INTEGER;""",
+        """ALTER TABLE workflow_table ADD COLUMN history_shown INTEGER NOT NULL DEFAULT 0;""",
+        """UPDATE workflow_table SET thread_id =
+           (SELECT r.thread_id FROM reports_table r WHERE r.mod_msg_id = workflow_table.mod_msg_id);""",
+        # unresolved reports the bot never recorded a step for start again from review
+        """INSERT OR IGNORE INTO workflow_table(mod_msg_id, step, thread_id, history_shown)
+           SELECT mod_msg_id, CASE WHEN reporter IS NULL THEN 'REVIEW_AUTOMATIC' ELSE 'REVIEW_MANUAL' END, thread_id, 0
+           FROM reports_table WHERE resolution IS NULL;"""
+    ]),
+    (5, "replay checkpoints", [
+        """CREATE TABLE IF NOT EXISTS checkpoints (
+               name TEXT PRIMARY KEY,
+               value INTEGER NOT NULL
+           );"""
+    ]),
+    (6, "integer epoch report times", [
+        # reports_table.time keeps its NOT NULL constraint, so new rows write the epoch there too
+        """ALTER TABLE reports_table ADD COLUMN created_at INTEGER;""",
+        """UPDATE reports_table SET created_at = CASE
+               WHEN typeof(time) = 'integer' THEN time
+               ELSE CAST(strftime('%s', substr(time, 1, 19), 'utc') AS INTEGER) END;""",
+        """CREATE INDEX IF NOT EXISTS reports_created_at_idx ON reports_table(created_at);""",
+        """CREATE INDEX IF NOT EXISTS reports_reported_account_time_idx ON reports_table(reported_account, created_at);""",
+        """CREATE INDEX IF NOT EXISTS reports_reporter_time_idx ON reports_table(reporter, created_at);""",
+        """ALTER TABLE workflow_table ADD COLUMN created_at INTEGER;""",
+        """UPDATE workflow_table SET created_at =
+           (SELECT MAX(r.created_at) FROM reports_table r WHERE r.mod_msg_id = workflow_table.mod_msg_id);""",
+        """CREATE INDEX IF NOT EXISTS workflow_created_at_idx ON workflow_table(created_at);"""
+    ]),
+    (7, "multi-guild routing", [
+        """ALTER TABLE workflow_table ADD COLUMN guild_id INTEGER;""",
+        """CREATE TABLE IF NOT EXISTS guild_channels (
+               guild_id INTEGER PRIMARY KEY,
+               mod_channel_id INTEGER,
+               main_channel_id INTEGER
+           );"""
+    ]),
+    (8, "per-message scores", [
+        """CREATE TABLE IF NOT EXISTS scores (
+               message_id INTEGER PRIMARY KEY,
+               author_id INTEGER,
+               scorer TEXT NOT NULL,
+               word_count INTEGER NOT NULL,
+               created_at INTEGER NOT NULL,
+               severe_toxicity REAL,
+               profanity REAL,
+               identity_attack REAL,
+               threat REAL,
+               toxicity REAL,
+               flirtation REAL
+           );""",
+        """CREATE INDEX IF NOT EXISTS scores_created_at_idx ON scores(created_at);"""
+    ]),
+    (9, "content hash of scored messages", [
+        # rows from before this migration have no hash, so they never match and are re-scored once
+        """ALTER TABLE scores ADD COLUMN content_hash TEXT;"""
+    ]),
+]
+
+
+def schema_version(db):
+    cursor = db.cursor()
+    cursor.execute(CREATE_SCHEMA_VERSION)
+    cursor.execute(SELECT_SCHEMA_VERSION)
+    version = cursor.fetchone()[0]
+    cursor.close()
+    return version or 0
+
+
+def migrate(db):
+    '''
+    Brings db up to the latest schema version, applying each pending migration in its own
+    transaction. Returns the resulting version. Safe to run from several bot processes at once:
+    each migration takes the write lock first and is skipped if another process already applied it.
+    '''
+    version = schema_version(db)
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            cursor = db.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            version = schema_version(db)
+            if target <= version:
+                cursor.close()
+                db.rollback()
+                continue
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(ADD_SCHEMA_VERSION, (target,))
+            db.commit()
+            cursor.close()
+        except Exception:
+            db.rollback()
+            raise
+        print(f"Migrated reports.db to version {target} ({description})")
+        version = target
+    return version
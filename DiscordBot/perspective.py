@@ -0,0 +1,74 @@
+# perspective.py
+import asyncio
+import aiohttp
+from scorer import Scorer
+
+PERSPECTIVE_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
+
+# Attributes requested for every message unless the caller asks for a different set
+ATTRIBUTES = ('SEVERE_TOXICITY', 'PROFANITY', 'IDENTITY_ATTACK', 'THREAT', 'TOXICITY', 'FLIRTATION')
+
+
+class PerspectiveClient(Scorer):
+    '''
+    Async client for the Perspective API. A single keep-alive aiohttp session is shared by every
+    scoring call for the lifetime of the bot, and a semaphore caps the number of requests in flight.
+    If a rate_limiter (e.g. pipeline.TokenBucket) is given, every request first acquires from it.
+    '''
+
+    name = "perspective"
+
+    def __init__(self, key, url=PERSPECTIVE_URL, attributes=ATTRIBUTES,
+                 total_timeout=10.0, connect_timeout=3.0, max_concurrency=16, rate_limiter=None):
+        self.key = key
+        self.url = url
+        self.attributes = tuple(attributes)
+        self.total_timeout = total_timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.session = None
+        self.semaphore = None
+
+    async def start(self):
+        # on_ready can fire more than once (e.g. after a reconnect), so only open the session once
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=self.total_timeout, connect=self.connect_timeout)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def build_request(self, text, attributes=None):
+        return {
+            'comment': {'text': text},
+            'languages': ['en'],
+            'requestedAttributes': {attr: {} for attr in (attributes or self.attributes)},
+            'doNotStore': True
+        }
+
+    async def score(self, text, attributes=None):
+        '''
+        Sends text to Perspective and returns a dictionary mapping each attribute to its summary score.
+        '''
+        if self.session is None:
+            await self.start()
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+
+        async with self.semaphore:
+            async with self.session.post(self.url, params={'key': self.key},
+                                         json=self.build_request(text, attributes)) as response:
+                response.raise_for_status()
+                response_dict = await response.json()
+
+        scores = {}
+        for attr in response_dict["attributeScores"]:
+            scores[attr] = response_dict["attributeScores"][attr]["summaryScore"]["value"]
+
+        return scores
@@ -0,0 +1,152 @@
+# pipeline.py
+import asyncio
+import aiohttp
+
+
+class TokenBucket:
+    '''
+    Async token bucket. Tokens refill continuously at `rate` per second up to `capacity`;
+    acquire() waits until a whole token is available.
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = None
+
+    def refill(self, now):
+        if self.last is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def acquire(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self.refill(loop.time())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ScoringPipeline:
+    '''
+    Queue between on_message and the scorer. Worker coroutines pull messages off the queue in
+    micro-batches, score each batch concurrently, and hand every (message, scores) pair to the
+    on_scored callback. Rate limiting is left to the scorer (see PerspectiveClient's rate_limiter)
+    so that cache hits don't spend quota; 429s that slip through are retried with backoff. If
+    score_batch is given, each micro-batch is scored with a single score_batch(messages) call instead.
+    Messages whose scoring or on_scored call fails are logged, counted in failures and, if given,
+    passed to on_failed(message, error).
+    '''
+
+    def __init__(self, score, on_scored, workers=4, batch_size=8, batch_wait=0.05,
+                 max_queue=1000, max_retries=3, retry_backoff=1.0, score_batch=None, on_failed=None):
+        self.score = score
+        self.score_batch = score_batch
+        self.on_scored = on_scored
+        self.on_failed = on_failed
+        self.failures = 0
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue = None
+        self.tasks = []
+
+    def running(self):
+        return len(self.tasks) > 0
+
+    def ensure_queue(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_queue)
+        return self.queue
+
+    async def start(self):
+        if self.running():
+            return
+        self.ensure_queue()
+        self.tasks = [asyncio.ensure_future(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, message):
+        # Messages submitted before start() wait in the queue for the workers, so nothing is scored
+        # (or stored) before the bot's database is open. Waits (rather than dropping) when the queue
+        # is full, so bursts apply backpressure
+        await self.ensure_queue().put(message)
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        # Give a burst a moment to fill the batch before draining whatever has arrived
+        if self.queue.qsize() < self.batch_size - 1:
+            await asyncio.sleep(self.batch_wait)
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def worker(self):
+        while True:
+            batch = await self.next_batch()
+            try:
+                if self.score_batch is not None:
+                    await self.process_batch(batch)
+                else:
+                    await asyncio.gather(*(self.process(message) for message in batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def process(self, message):
+        scores = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                scores = await self.score(message)
+                break
+            except aiohttp.ClientResponseError as e:
+                if e.status == 429 and attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                    continue
+                print(f"Scoring failed for message {message.id}: {e}")
+                return self.fail(message, e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Scoring failed for message {message.id}: {e!r}")
+                return self.fail(message, e)
+            except Exception as e:
+                # e.g. a malformed response or a cache error; the worker has to outlive it
+                print(f"Scoring failed for message {message.id}: {e!r}")
+                return self.fail(message, e)
+
+        if scores is None:
+            return
+        await self.deliver(message, scores)
+
+    async def process_batch(self, batch):
+        # For scorers that take a whole batch in one call (see Scorer.batched)
+        try:
+            results = await self.score_batch(batch)
+        except Exception as e:
+            print(f"Scoring failed for a batch of {len(batch)} messages: {e!r}")
+            for message in batch:
+                self.fail(message, e)
+            return
+        await asyncio.gather(*(self.deliver(message, scores) for message, scores in zip(batch, results)))
+
+    async def deliver(self, message, scores):
+        try:
+            await self.on_scored(message, scores)
+        except Exception as e:
+            print(f"Handling scores failed for message {message.id}: {e!r}")
+            self.fail(message, e)
+
+    def fail(self, message, error):
+        self.failures += 1
+        if self.on_failed is not None:
+            self.on_failed(message, error)
@@ -0,0 +1,175 @@
+# prefilter.py
+import re
+from collections import deque
+from enum import Enum, auto
+
+# Phrases that go straight to the mod channel without waiting on Perspective
+ESCALATE_TERMS = (
+    "kill you", "kill yourself", "kys", "shoot you", "stab you", "going to hurt you",
+    "gonna hurt you", "i know where you live", "bomb threat", "end your life"
+)
+
+# Phrases that are not conclusive on their own but mean the message needs a real score
+SUSPICIOUS_TERMS = (
+    "kill", "die", "dead", "hurt", "shoot", "gun", "knife", "hate", "stupid", "idiot", "loser",
+    "ugly", "trash", "shut up", "dumb", "worthless", "pathetic", "retard", "slut", "whore",
+    "bitch", "fuck", "shit", "sexy", "hot", "nudes", "send pics", "how old are you", "your age",
+    "where do you live", "your address", "phone number", "meet up", "pick you up", "give you a ride",
+    "alone", "secret", "don't tell", "password", "login", "verify your account", "free nitro",
+    "gift card", "giveaway", "crypto", "investment", "venmo", "cashapp", "paypal", "dm me"
+)
+
+# Everyday chat words; only a message made up entirely of these can be skipped without a score
+SAFE_TOKENS = frozenset((
+    "hi", "hello", "hey", "heya", "yo", "sup", "morning", "good", "night", "gn", "gm", "evening",
+    "thanks", "thank", "thx", "ty", "tysm", "np", "welcome", "please", "pls", "sorry", "ok", "okay",
+    "k", "kk", "yes", "yeah", "yep", "yup", "no", "nope", "nah", "sure", "maybe", "lol", "lmao",
+    "haha", "hahaha", "xd", "gg", "ggs", "wp", "nice", "cool", "great", "awesome", "same", "true",
+    "agreed", "bye", "cya", "later", "soon", "brb", "omw", "done", "got", "it", "me",
+    "too", "and", "the", "a", "that", "this", "is", "was", "so", "very", "much", "all", "everyone",
+    "guys", "i", "i'm", "im", "you", "we", "what", "when", "how", "time", "today", "tomorrow"
+))
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+LINK_RE = re.compile(r"https?://|www\.|discord\.gg/", re.IGNORECASE)
+
+
+class Verdict(Enum):
+    BENIGN = auto()
+    ESCALATE = auto()
+    SCORE = auto()
+
+
+class KeywordIndex:
+    '''
+    Aho-Corasick automaton over word tokens, so a single pass over a message finds every phrase
+    in the index and phrases only ever match on whole-word boundaries.
+    '''
+
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for phrase in phrases:
+            self.add(phrase)
+        self.build()
+
+    def add(self, phrase):
+        node = 0
+        for token in TOKEN_RE.findall(phrase.lower()):
+            if token not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][token] = len(self.goto) - 1
+            node = self.goto[node][token]
+        self.output[node].append(phrase)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and token not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(token, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, tokens):
+        matches = []
+        node = 0
+        for token in tokens:
+            while node and token not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(token, 0)
+            matches.extend(self.output[node])
+        return matches
+
+
+class PreFilter:
+    '''
+    Cheap in-process stage in front of eval_text. By default every message is sent for scoring;
+    both shortcuts are opt-in. With escalate, messages containing an escalation phrase go to the mod
+    channel without a score (and so without a row in the scores table). With a non-negative
+    safety_threshold, a message is skipped as benign when it is affirmatively low-risk: at most
+    max_benign_words words, all of them in SAFE_TOKENS, and a lexical risk (shouting, links,
+    mentions, punctuation) at or below safety_threshold. Check a threshold against stored scores
+    with backtest.py before turning it on.
+    '''
+
+    def __init__(self, safety_threshold=-1.0, escalate=False, escalate_terms=ESCALATE_TERMS,
+                 suspicious_terms=SUSPICIOUS_TERMS, safe_tokens=SAFE_TOKENS, max_benign_words=8):
+        self.safety_threshold = safety_threshold
+        self.escalate = escalate
+        self.safe_tokens = safe_tokens
+        self.max_benign_words = max_benign_words
+        self.escalate_index = KeywordIndex(escalate_terms)
+        self.suspicious_index = KeywordIndex(suspicious_terms)
+        self.counts = {verdict: 0 for verdict in Verdict}
+
+    def features(self, text):
+        tokens = TOKEN_RE.findall(text.lower())
+        letters = [c for c in text if c.isalpha()]
+        caps = sum(1 for c in letters if c.isupper())
+        return {
+            "words": len(tokens),
+            "caps_ratio": caps / len(letters) if len(letters) >= 8 else 0.0,
+            "links": len(LINK_RE.findall(text)),
+            "exclamations": text.count("!"),
+            "mentions": text.count("<@")
+        }
+
+    def risk(self, features):
+        risk = 0.5 * features["caps_ratio"]
+        risk += 0.3 * min(features["links"], 3)
+        risk += 0.1 * min(features["mentions"], 3)
+        if features["exclamations"] > 3:
+            risk += 0.2
+        if features["words"] > 40:
+            risk += 0.2
+        return risk
+
+    def is_benign(self, text, tokens, suspicious, risk):
+        if self.safety_threshold < 0 or suspicious or risk > self.safety_threshold:
+            return False
+        if not tokens or len(tokens) > self.max_benign_words:
+            return False
+        # letters TOKEN_RE doesn't cover (accents, other scripts) could be anything
+        if any(c.isalnum() for c in TOKEN_RE.sub("", text.lower())):
+            return False
+        return all(token in self.safe_tokens for token in tokens)
+
+    def classify(self, text):
+        '''
+        Returns a (Verdict, details) pair for a message's text. details holds the matched phrases,
+        features and risk so an escalation can explain itself in the mod channel.
+        '''
+        tokens = TOKEN_RE.findall(text.lower())
+        escalate = self.escalate_index.search(tokens)
+        if escalate and self.escalate:
+            verdict, details = Verdict.ESCALATE, {"matched": sorted(set(escalate))}
+        else:
+            # without escalation, escalation phrases still keep a message from being skipped
+            suspicious = self.suspicious_index.search(tokens) + escalate
+            features = self.features(text)
+            risk = self.risk(features)
+            details = {"matched": sorted(set(suspicious)), "features": features, "risk": round(risk, 3)}
+            if self.is_benign(text, tokens, suspicious, risk):
+                verdict = Verdict.BENIGN
+            else:
+                verdict = Verdict.SCORE
+
+        self.counts[verdict] += 1
+        return verdict, details
+
+    def stats(self):
+        total = sum(self.counts.values())
+        skipped = self.counts[Verdict.BENIGN] + self.counts[Verdict.ESCALATE]
+        return {
+            "benign": self.counts[Verdict.BENIGN],
+            "escalated": self.counts[Verdict.ESCALATE],
+            "scored": self.counts[Verdict.SCORE],
+            "skip_rate": skipped / total if total else 0.0
+        }
@@ -20,5 +20,6 @@ if __name__ == "__main__":
         text += f"mod_msg_id: {row[6]}\n" + f"thread_id: {row[7]}\n" 
         text += f"msg_content: {row[8]}\n" + f"time: {row[9]}\n" 
         text += f"additional_info: {row[10]}\n" + f"resolution: {row[11]}\n"
+        if len(row) > 12: text += f"created_at: {row[12]}\n"
     
     print(text)
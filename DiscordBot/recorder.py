@@ -0,0 +1,96 @@
+# recorder.py
+'''
+Captures the events ModBot receives (channel messages, DMs, reactions) to a JSONL file, one event
+per line, so a real spam wave or moderator session can be fed back through the bot offline with
+replay.py.
+
+With redact=True, ids and names are replaced by salted hashes and message text by a digest of it.
+The salt lives only in memory, so a redacted recording can't be mapped back to real accounts, but
+equal ids and equal texts still hash equally, which keeps threads of conversation, repeated spam
+and score-cache hits intact on replay. Message links and the short answers of the DM report flow
+are kept readable (with their ids hashed) so reports still walk through Report.handle_message.
+The text digests score differently from the original messages, though, so a redacted recording
+can't reproduce the bot's automatic flag reports on replay, only the manual ones.
+'''
+import hashlib
+import json
+import os
+import re
+import time
+from report import Report
+
+LINK_PATTERN = re.compile(r'/(\d+)/(\d+)/(\d+)')
+MOD_MESSAGE_ID = re.compile(r'Message ID: (\d+)')
+REPORT_ANSWERS = {Report.START_KEYWORD, Report.CANCEL_KEYWORD, Report.HELP_KEYWORD,
+                  "1", "2", "3", "4", "yes", "no"}
+FLUSH_EVERY = 100  # events between flushes of the recording file
+
+
+class EventRecorder:
+    def __init__(self, path, redact=False):
+        self.path = path
+        self.redact = redact
+        self.salt = os.urandom(16)
+        self.file = open(path, "a", encoding="utf-8")
+        self.start = time.monotonic()
+        self.events = 0
+
+    def digest(self, value):
+        return hashlib.sha256(self.salt + str(value).encode("utf-8")).hexdigest()
+
+    def pseudonym(self, value):
+        # stays a snowflake-sized integer so it still fits message links and INTEGER columns
+        return int(self.digest(value)[:15], 16) if self.redact else value
+
+    def text(self, content):
+        return f"[redacted {self.digest(content)[:16]}]" if self.redact else content
+
+    def dm_text(self, content):
+        if not self.redact or content in REPORT_ANSWERS:
+            return content
+        link = LINK_PATTERN.search(content)
+        if link:
+            return "https://discord.com/channels/" + "/".join(str(self.pseudonym(i)) for i in link.groups())
+        return self.text(content)
+
+    def write(self, event):
+        event["t"] = round(time.monotonic() - self.start, 4)
+        self.file.write(json.dumps(event) + "\n")
+        self.events += 1
+        if self.events % FLUSH_EVERY == 0:
+            self.file.flush()
+
+    def message(self, message, kind, from_bot):
+        '''
+        kind is "main", "mod" or "dm". Of the bot's own messages only mod channel reports are kept,
+        as the link between a report message id and the message it reports, which replay.py needs
+        to aim recorded reactions at the replayed report.
+        '''
+        if from_bot:
+            reported = MOD_MESSAGE_ID.search(message.content or "")
+            if kind != "mod" or not reported:
+                return
+            self.write({"type": "report", "message_id": self.pseudonym(message.id),
+                        "reported_id": self.pseudonym(int(reported.group(1))),
+                        "automatic": message.content.startswith("```This message was flagged automatically")})
+            return
+
+        self.write({
+            "type": "message",
+            "channel": kind,
+            "message_id": self.pseudonym(message.id),
+            "author_id": self.pseudonym(message.author.id),
+            "author_name": self.digest(message.author.name)[:12] if self.redact else message.author.name,
+            "content": self.dm_text(message.content) if kind == "dm" else self.text(message.content),
+        })
+
+    def reaction(self, payload):
+        self.write({
+            "type": "reaction",
+            "message_id": self.pseudonym(payload.message_id),
+            "user_id": self.pseudonym(payload.user_id),
+            "emoji": str(payload.emoji),
+        })
+
+    def close(self):
+        self.file.close()
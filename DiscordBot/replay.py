@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# replay.py
+'''
+Feeds a recording made with record_events=<path> (see recorder.py) back into ModBot against the
+fake Discord and Perspective stand-ins from fakes.py, at the recorded pace, sped up, or as fast as
+possible (--speed 0). Recorded ids are mapped onto fresh fake messages and users: message links in
+DMs point at the replayed copy of the message, and reactions land on the report the replay opened
+for the same reported message.
+
+A reaction whose report doesn't reappear is counted as unmatched and skipped: at once if the
+reported message was sent before the recording started, as soon as the replayed message has been
+scored without the bot posting a report for it, and otherwise after REACTION_WAIT. Redacted recordings replay digests in place of
+message text, which the stand-in scores differently, so their automatic flag reports don't reappear
+and reactions on them end up unmatched; manual reports still replay.
+
+    python3 replay.py events.jsonl --speed 10 --workers 8 --score-cache-size 500
+'''
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmark import LoopLagMonitor, ScoringTracker, percentile
+from fakes import FakeDiscord, FakeModBot, FakePayload, PerspectiveStandIn
+from pipeline import TokenBucket
+from recorder import LINK_PATTERN
+
+REACTION_WAIT = 30.0  # seconds to wait for the report a recorded reaction targets to be replayed
+
+
+class Replayer:
+    def __init__(self, bot, speed=1.0):
+        self.bot = bot
+        self.speed = speed
+        self.users = {}  # recorded user id -> FakeUser
+        self.messages = {}  # recorded message id -> FakeMessage
+        self.reports = {}  # recorded report message id -> (recorded id of the message it reports, automatic)
+        self.handled = {}  # recorded message id -> task running on_message and scoring for its replayed copy
+        self.tracker = ScoringTracker(bot)
+        self.report_ids = {}  # recorded report message id -> replayed report message id
+        self.dm_chains = {}  # user id -> task handling that user's previous DM
+        self.counts = {}
+        self.behind = []  # seconds each event was dispatched after its scheduled time
+
+    def user(self, user_id, name=None):
+        if user_id not in self.users:
+            self.users[user_id] = self.bot.member(name or f"user-{user_id}")
+        return self.users[user_id]
+
+    def message(self, message_id):
+        # reports may link to messages sent before the recording started
+        if message_id not in self.messages:
+            self.messages[message_id] = self.bot.fake_main.post(self.user(0, "unrecorded"), "[not recorded]")
+        return self.messages[message_id]
+
+    def relink(self, content):
+        link = LINK_PATTERN.search(content)
+        if not link:
+            return content
+        return self.bot.message_link(self.message(int(link.group(3))))
+
+    async def after(self, previous, coro):
+        # a user's DMs go through Report.handle_message one at a time, in order
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        await coro
+
+    async def report_id(self, recorded_id):
+        if recorded_id in self.report_ids:
+            return self.report_ids[recorded_id]
+        reported, automatic = self.reports.get(recorded_id, (None, False))
+        # not a report the recording saw opened, or one about a message from before the recording
+        if reported is None or reported not in self.messages:
+            return None
+
+        replayed = self.messages[reported].id
+        handled = self.handled.get(reported) if automatic else None
+        deadline = time.monotonic() + REACTION_WAIT
+        while recorded_id not in self.report_ids and time.monotonic() < deadline:
+            claimed = set(self.report_ids.values())
+            for mod_msg_id, entry in self.bot.open_entries.items():
+                if entry.original_msg_id == replayed and mod_msg_id not in claimed:
+                    self.report_ids[recorded_id] = mod_msg_id
+                    break
+            else:
+                if handled is not None and handled.done():
+                    # once scored, flag_channel_message has posted the report if there is going to be one
+                    if not self.posted_report(replayed):
+                        return None
+                    handled = None
+                await asyncio.sleep(0.01)
+        return self.report_ids.get(recorded_id)
+
+    def posted_report(self, message_id):
+        marker = f"Message ID: {message_id} "
+        return any(message.author is self.bot.user and marker in message.content
+                   for message in list(self.bot.fake_mod.messages.values()))
+
+    async def react(self, event):
+        mod_msg_id = await self.report_id(event["message_id"])
+        if mod_msg_id is None:
+            self.counts["unmatched_reactions"] = self.counts.get("unmatched_reactions", 0) + 1
+            return
+        payload = FakePayload(self.bot.fake_mod.id, mod_msg_id, self.user(event["user_id"]).id, event["emoji"])
+        await self.bot.on_raw_reaction_add(payload)
+
+    def dispatch(self, event):
+        kind = event["type"] if event["type"] != "message" else event["channel"]
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+        if event["type"] == "report":
+            # recordings from before "automatic" was recorded count as manual, which always wait
+            self.reports[event["message_id"]] = (event["reported_id"], event.get("automatic", False))
+        elif event["type"] == "reaction":
+            self.bot.fake.spawn(self.react(event))
+        elif event["channel"] == "dm":
+            author = self.user(event["author_id"], event["author_name"])
+            message = author.dm_channel.post(author, self.relink(event["content"]))
+            task = self.bot.fake.spawn(self.after(self.dm_chains.get(author.id), self.bot.on_message(message)))
+            self.dm_chains[author.id] = task
+        else:
+            channel = self.bot.fake_main if event["channel"] == "main" else self.bot.fake_mod
+            author = self.user(event["author_id"], event["author_name"])
+            message = channel.post(author, event["content"])
+            self.messages[event["message_id"]] = message
+            self.handled[event["message_id"]] = self.bot.fake.spawn(self.tracker.handle(self.bot, message))
+
+    async def run(self, events):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        for event in events:
+            if self.speed > 0:
+                due = start + event["t"] / self.speed
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                self.behind.append(max(0.0, loop.time() - due))
+            self.dispatch(event)
+        await self.bot.fake.drain()
+        await self.bot.pipeline.queue.join()
+        await self.bot.fake.drain()
+
+
+def read_events(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+async def main(args):
+    fake = FakeDiscord(latency=args.discord_latency, jitter=args.discord_latency / 2, seed=args.seed)
+    perspective = PerspectiveStandIn(latency=args.perspective_latency, jitter=args.perspective_latency / 2,
+                                     error_rate=args.error_rate, seed=args.seed)
+    url = await perspective.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = FakeModBot(fake, url, os.path.join(tmp, "reports.db"))
+        bot.perspective.rate_limiter = TokenBucket(args.qps) if args.qps > 0 else None
+        bot.pipeline.workers = args.workers
+        if args.score_cache_size is not None:
+            bot.score_cache.max_entries = args.score_cache_size
+        await bot.setup()
+
+        replayer = Replayer(bot, args.speed)
+        monitor = LoopLagMonitor()
+        monitor.start()
+        started = time.perf_counter()
+        await replayer.run(read_events(args.path))
+        elapsed = time.perf_counter() - started
+        lag = await monitor.stop()
+
+        summary = {
+            "events": replayer.counts,
+            "seconds": round(elapsed, 3),
+            "behind_schedule_p99_ms": round(percentile(replayer.behind, 0.99) * 1000, 2),
+            "loop_lag_p99_ms": round(percentile(lag, 0.99) * 1000, 2),
+            "reports_still_open": len(bot.open_threads),
+            "perspective_requests": perspective.requests,
+            "perspective_errors": perspective.errors,
+            "discord_calls": fake.calls,
+            "score_cache": bot.score_cache.stats(),
+            "prefilter": bot.prefilter.stats(),
+        }
+        await bot.close()
+    await perspective.stop()
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSONL recording made with record_events")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed multiplier (0 = no delays)")
+    parser.add_argument("--workers", type=int, default=4, help="scoring pipeline workers")
+    parser.add_argument("--score-cache-size", type=int, default=None, help="score cache entries")
+    parser.add_argument("--qps", type=float, default=0, help="Perspective QPS limit (0 = unlimited)")
+    parser.add_argument("--discord-latency", type=float, default=0.02, help="seconds per fake Discord REST call")
+    parser.add_argument("--perspective-latency", type=float, default=0.05, help="seconds per Perspective call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Perspective calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.speed < 0:
+        sys.exit("--speed must be 0 or positive")
+    summary = asyncio.run(main(args))
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            print(f"{key:>24}: {value}")
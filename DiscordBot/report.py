@@ -1,3 +1,4 @@
+from collections import namedtuple
 from enum import Enum, auto
 import discord
 import re
@@ -17,7 +18,21 @@ class State(Enum):
     AWAITING_INFO = auto()
     REPORT_COMPLETE = auto()
 
+# Immutable copy of the reported message, taken when AWAITING_MESSAGE fetches it. It has the fields of
+# a discord.Message that ModBot reads when the report is submitted, so submitting needs no refetch and
+# still works if the message has been deleted since.
+AuthorSnapshot = namedtuple("AuthorSnapshot", ["id", "name"])
+MessageSnapshot = namedtuple("MessageSnapshot", ["id", "content", "author", "channel_id", "guild_id"])
+
+
+def snapshot(message, guild_id):
+    return MessageSnapshot(message.id, message.content, AuthorSnapshot(message.author.id, message.author.name),
+                           message.channel.id, guild_id)
+
+
 class Report:
+    __slots__ = ("state", "client", "message", "category", "subcategory", "involve_authorities", "additional_info")
+
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
     HELP_KEYWORD = "help"
@@ -32,10 +47,7 @@ class Report:
     def __init__(self, client):
         self.state = State.REPORT_START
         self.client = client
-        self.reported_acc = None
-        self.reported_msg = None
-        self.msg_content = None
-        self.msg_channel_id = None
+        self.message = None  # MessageSnapshot of the reported message
         self.category = None
         self.subcategory = None
         self.involve_authorities = None
@@ -65,10 +77,10 @@ class Report:
             m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
             if not m:
                 return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
+            guild_id = int(m.group(1))
+            if not await self.client.known_guild(guild_id):
                 return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
-            channel = guild.get_channel(int(m.group(2)))
+            channel = await self.client.report_channel(guild_id, int(m.group(2)))
             if not channel:
                 return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
             try:
@@ -77,10 +89,7 @@ class Report:
                 return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
 
             # Here we've found the message
-            self.msg_content = message.content
-            self.msg_channel_id = message.channel.id
-            self.reported_msg = message.id
-            self.reported_acc = message.author.id
+            self.message = snapshot(message, guild_id)
             reply = "I found this message:\n" + "```" + message.author.name + ": " + message.content + "``` \n"
             reply += "What is your reason for reporting this message? "
             reply += "Reply '1' for Threat of Danger/Harm, "
@@ -220,7 +229,7 @@ class Report:
             m = message.content
             reply = "I don't understand that response. Please reply with either 'yes' or 'no'."
             if m == "yes":
-                user = await self.client.fetch_user(self.reported_acc)
+                user = await self.client.fetch_user(self.message.author.id)
                 await user.send(self.SUICIDE_PREVENTION_MESSAGE)
                 reply = "The message has been sent, and resources have been shared anonymously with the user in concern. "
                 reply += self.BLOCK_REQUEST
@@ -0,0 +1,91 @@
+# rules.py
+'''
+The thresholds behind ModBot.should_flag, as data, so backtest.py can evaluate candidate rule sets
+against stored scores and the bot can load the chosen one (flag_rules=<path to JSON>).
+
+A rule set has a "small" and a "large" section. A message of at most max_small_words words is
+flagged if it passes the small section's base rules; any message is flagged if it passes the large
+section's base rules or one of its extra large_* rules. The default reproduces the original
+hard-coded should_flag.
+'''
+import json
+import numpy as np
+
+DEFAULT_SECTION = {
+    "toxic_sum": 2.8,  # PROFANITY + TOXICITY + SEVERE_TOXICITY >=
+    "flirt_threat_sum": 0.8,  # FLIRTATION + THREAT >= ...
+    "flirt_threat_min_threat": 0.3,  # ... and THREAT >
+    "threat": 0.85,  # THREAT >
+    "identity_attack": 0.825,  # IDENTITY_ATTACK >=
+}
+DEFAULT_LARGE_EXTRAS = {
+    "large_identity_attack": 0.60,  # IDENTITY_ATTACK >
+    "large_severe_toxicity": 0.8,  # SEVERE_TOXICITY >
+}
+DEFAULT_RULES = {
+    "name": "default",
+    "max_small_words": 15,
+    "small": dict(DEFAULT_SECTION),
+    "large": dict(DEFAULT_SECTION, **DEFAULT_LARGE_EXTRAS),
+}
+
+
+def complete(rules):
+    # fills in anything a (possibly partial) rule set leaves out from DEFAULT_RULES
+    return {
+        "name": rules.get("name", "unnamed"),
+        "max_small_words": rules.get("max_small_words", DEFAULT_RULES["max_small_words"]),
+        "small": dict(DEFAULT_RULES["small"], **rules.get("small", {})),
+        "large": dict(DEFAULT_RULES["large"], **rules.get("large", {})),
+    }
+
+
+def load_rules(path):
+    with open(path, encoding="utf-8") as f:
+        return complete(json.load(f))
+
+
+def base_rules(scores, section):
+    if scores["PROFANITY"] + scores["TOXICITY"] + scores["SEVERE_TOXICITY"] >= section["toxic_sum"]: return True
+    elif scores["FLIRTATION"] + scores["THREAT"] >= section["flirt_threat_sum"] and \
+            scores["THREAT"] > section["flirt_threat_min_threat"]: return True
+    elif scores["THREAT"] > section["threat"]: return True
+    elif scores["IDENTITY_ATTACK"] >= section["identity_attack"]: return True
+    return False
+
+
+def should_flag(scores, type, rules=DEFAULT_RULES):
+    section = rules[type]
+    if base_rules(scores, section): return True
+
+    if type == "large":
+        if scores["IDENTITY_ATTACK"] > section["large_identity_attack"]: return True
+        if scores["SEVERE_TOXICITY"] > section["large_severe_toxicity"]: return True
+
+    return False
+
+
+def flag_message(scores, word_count, rules=DEFAULT_RULES):
+    return (word_count <= rules["max_small_words"] and should_flag(scores, "small", rules)) or \
+        should_flag(scores, "large", rules)
+
+
+def flag_masks(scores, word_counts, rule_sets):
+    '''
+    Vectorized flag_message for many rule sets at once. scores maps attribute -> (N,) array,
+    word_counts is an (N,) array; returns an (R, N) boolean array, one row per rule set.
+    '''
+    def column(section, key):
+        return np.array([[rules[section][key]] for rules in rule_sets])
+
+    def base(section):
+        return ((scores["PROFANITY"] + scores["TOXICITY"] + scores["SEVERE_TOXICITY"] >= column(section, "toxic_sum"))
+                | ((scores["FLIRTATION"] + scores["THREAT"] >= column(section, "flirt_threat_sum"))
+                   & (scores["THREAT"] > column(section, "flirt_threat_min_threat")))
+                | (scores["THREAT"] > column(section, "threat"))
+                | (scores["IDENTITY_ATTACK"] >= column(section, "identity_attack")))
+
+    short = word_counts <= np.array([[rules["max_small_words"]] for rules in rule_sets])
+    large = base("large") | (scores["IDENTITY_ATTACK"] > column("large", "large_identity_attack")) \
+        | (scores["SEVERE_TOXICITY"] > column("large", "large_severe_toxicity"))
+    return (short & base("small")) | large
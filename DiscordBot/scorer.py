@@ -0,0 +1,26 @@
+# scorer.py
+import asyncio
+
+
+class Scorer:
+    '''
+    Interface ModBot scores messages through (PerspectiveClient, local_model.LocalScorer). score()
+    returns a dictionary mapping attribute names (TOXICITY, THREAT, IDENTITY_ATTACK, ...) to
+    probabilities; score_batch() does the same for a list of texts. Backends that set batched = True
+    score a whole batch in one call, and the scoring pipeline hands them its micro-batches whole.
+    '''
+
+    name = "scorer"
+    batched = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def score(self, text, attributes=None):
+        raise NotImplementedError
+
+    async def score_batch(self, texts, attributes=None):
+        return await asyncio.gather(*(self.score(text, attributes) for text in texts))
@@ -0,0 +1,49 @@
+# sessions.py
+import asyncio
+import time
+
+
+class SessionStore:
+    '''
+    Map from user id to an in-progress DM Report that forgets sessions left idle for longer than ttl
+    seconds. Reading or replacing a session counts as activity; run() sweeps expired sessions every
+    interval seconds so abandoned reports don't accumulate for the life of the bot.
+    '''
+
+    def __init__(self, ttl=30 * 60):
+        self.ttl = ttl
+        self.sessions = {}  # user id -> (last active, session)
+        self.expired = 0
+
+    def __contains__(self, key):
+        return key in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __getitem__(self, key):
+        session = self.sessions[key][1]
+        self.sessions[key] = (time.monotonic(), session)
+        return session
+
+    def __setitem__(self, key, session):
+        self.sessions[key] = (time.monotonic(), session)
+
+    def pop(self, key, default=None):
+        entry = self.sessions.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        stale = [key for key, (last_active, _) in self.sessions.items() if now - last_active > self.ttl]
+        for key in stale:
+            del self.sessions[key]
+        self.expired += len(stale)
+        return stale
+
+    async def run(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            stale = self.sweep()
+            if stale:
+                print(f"Expired {len(stale)} idle report sessions")
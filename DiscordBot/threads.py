@@ -0,0 +1,22 @@
+# threads.py
+from discord.http import Route
+
+
+class V9Route(Route):
+    # discord.py 1.7 targets API v7, which predates threads
+    BASE = 'https://discord.com/api/v9'
+
+
+async def start_thread(http, channel_id, message_id, name, auto_archive_duration=60):
+    '''
+    Starts a thread on a message through the client's HTTP session, so the request shares its
+    connection pool and waits on the channel's rate-limit bucket. Returns the thread object.
+    '''
+    route = V9Route('POST', '/channels/{channel_id}/messages/{message_id}/threads',
+                    channel_id=channel_id, message_id=message_id)
+    return await http.request(route, json={"name": name, "auto_archive_duration": auto_archive_duration})
+
+
+async def send_message(http, channel_id, content):
+    route = V9Route('POST', '/channels/{channel_id}/messages', channel_id=channel_id)
+    return await http.request(route, json={"content": content})
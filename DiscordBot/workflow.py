@@ -0,0 +1,132 @@
+# workflow.py
+from collections import namedtuple
+from enum import Enum, auto
+
+
+class Step(Enum):
+    REVIEW_AUTOMATIC = auto()
+    REVIEW_MANUAL = auto()
+    AWAITING_CATEGORY = auto()
+    AWAITING_THREAT = auto()
+    AWAITING_HARASSMENT = auto()
+    AWAITING_SPAM = auto()
+    AWAITING_SUSPICIOUS = auto()
+    AWAITING_ACTION = auto()
+    AWAITING_INVALID_ACTION = auto()
+    RESOLVED = auto()
+
+
+# next_step: step the report moves to
+# remove / add: reactions the bot takes off / puts on the report message
+# prompt: message posted to the report's thread
+# subcategory: emoji passed to database.update_categories, if the step picks one
+# resolution: action stored with database.update_resolution, if the step closes the report
+Transition = namedtuple("Transition", ["next_step", "remove", "add", "prompt", "subcategory", "resolution"])
+
+HISTORY_EMOJI = '❕'
+REVIEW_EMOJIS = ['👍', '👎']
+CATEGORY_EMOJIS = ["1️⃣", "2️⃣", "3️⃣", "4️⃣"]
+ACTION_EMOJIS = ["🥾", "🔒", "👮", "🚮"]
+INVALID_EMOJIS = ["🤐", "🚮"]
+
+REVIEW_PROMPT = "Is this a valid report? Please react on the outer message with 👍 or 👎.\n" + \
+                "You can view the report history with ❕."
+
+CATEGORY_PROMPT = "What category best describes this message?\n" + \
+                  "1️⃣: Threat of Danger or Harm\n" + \
+                  "2️⃣: Harassment\n" + "3️⃣: Spam\n" + \
+                  "4️⃣: Suspicious Behavior\n"
+
+ACTION_PROMPT = "Please react on the message with one of the following emojis to perform an" + \
+                " appropriate action.\n" + "Ban Account: 🥾\n" + "Restrict Account: 🔒\n" + \
+                "Alert Law Enforcement: 👮\n" + "Do Nothing (Delete Report): 🚮"
+
+INVALID_PROMPT = "If you would like to restrict this user from reporting, please react on the" + \
+                 " message with 🤐. If you would like to discard this report, react with 🚮."
+
+# category emoji -> (step, subcategory emojis, prompt)
+CATEGORY_STEPS = {
+    "1️⃣": (Step.AWAITING_THREAT, ['🔘', '🔴'],
+           "Please select a subcategory.\n" + "🔘: Credible Threat of Violence\n" +
+           "🔴: Suicidal Comments\n"),
+    "2️⃣": (Step.AWAITING_HARASSMENT, ['🟠', '🟡', '🟢'],
+           "Please select a subcategory.\n" + "🟠: Sexual Harassment\n" +
+           "🟡: Hate Speech\n" + "🟢: Bullying"),
+    "3️⃣": (Step.AWAITING_SPAM, ['🔵', '🟣'],
+           "Please select a subcategory.\n" + "🔵: Unwanted Solicitation\n" +
+           "🟣: Scam or Fradulent Business"),
+    "4️⃣": (Step.AWAITING_SUSPICIOUS, ['⚫️', '⚪️', '🟤', '🔶'],
+           "Please select a subcategory.\n" + "⚫️: Possible Grooming\n" +
+           "⚪️: Impersonation or Compromised Account\n" +
+           "🟤: Attempt to Solicit Personal Information\n" +
+           "🔶: Offer of Transportation"),
+}
+
+# emoji -> (resolution, thread message)
+ACTIONS = {
+    "🥾": ("USER BANNED", "User has been banned."),
+    "🔒": ("USER RESTRICTED (MESSAGING)", "User has been restricted."),
+    "👮": ("AUTHORITIES ALERTED", "Local authorities are being notified."),
+    "🚮": ("REPORT DELETED (NO ACTION)", "Message is being deleted."),
+    "🤐": ("USER RESTRICTED (REPORTING)", "User has been restricted from reporting."),
+}
+
+
+def compile_transitions():
+    '''
+    Expands the moderator flow above into a flat (step, emoji) -> Transition table.
+    '''
+    table = {}
+
+    table[(Step.REVIEW_AUTOMATIC, "👍")] = Transition(
+        Step.AWAITING_CATEGORY, REVIEW_EMOJIS, CATEGORY_EMOJIS, CATEGORY_PROMPT, None, None)
+    table[(Step.REVIEW_MANUAL, "👍")] = Transition(
+        Step.AWAITING_ACTION, REVIEW_EMOJIS, ACTION_EMOJIS, ACTION_PROMPT, None, None)
+    for step in (Step.REVIEW_AUTOMATIC, Step.REVIEW_MANUAL):
+        table[(step, "👎")] = Transition(
+            Step.AWAITING_INVALID_ACTION, REVIEW_EMOJIS, INVALID_EMOJIS, INVALID_PROMPT, None, None)
+
+    for emoji, (step, subcategories, prompt) in CATEGORY_STEPS.items():
+        table[(Step.AWAITING_CATEGORY, emoji)] = Transition(
+            step, CATEGORY_EMOJIS, subcategories, prompt, None, None)
+        for subcategory in subcategories:
+            table[(step, subcategory)] = Transition(
+                Step.AWAITING_ACTION, subcategories, ACTION_EMOJIS, ACTION_PROMPT, subcategory, None)
+
+    for step, emojis in ((Step.AWAITING_ACTION, ACTION_EMOJIS), (Step.AWAITING_INVALID_ACTION, INVALID_EMOJIS)):
+        for emoji in emojis:
+            resolution, prompt = ACTIONS[emoji]
+            table[(step, emoji)] = Transition(Step.RESOLVED, emojis, [], prompt, None, resolution)
+
+    return table
+
+
+TRANSITIONS = compile_transitions()
+
+# Reactions the bot has on a report message while it is waiting in each step
+STEP_EMOJIS = {step: set() for step in Step}
+for (step, emoji) in TRANSITIONS:
+    STEP_EMOJIS[step].add(emoji)
+
+
+def initial_step(entry):
+    # Manual reports already carry a category, so they go straight to choosing an action
+    return Step.REVIEW_AUTOMATIC if entry.reporter is None else Step.REVIEW_MANUAL
+
+
+def next_transition(step, emoji):
+    return TRANSITIONS.get((step, emoji))
+
+
+def infer_step(entry, offered):
+    '''
+    Best guess at the step of a report that predates persisted workflow state, from the reactions
+    the bot has left on its message.
+    '''
+    offered = set(offered) - {HISTORY_EMOJI}
+    if offered == STEP_EMOJIS[Step.REVIEW_AUTOMATIC]:
+        return initial_step(entry)
+    for step, emojis in STEP_EMOJIS.items():
+        if emojis and emojis == offered:
+            return step
+    return initial_step(entry)